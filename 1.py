@@ -1,24 +1,2625 @@
+import time  # measure speed
+
+STARTUP_START = time.perf_counter()  # start of startup timing mode
+
 import tkinter as tk  # for gui stuff
 from tkinter import ttk, filedialog, Menu  # use dropdown and file menu
-from PIL import Image, ImageTk  # image show inside gui
-import cv2  # use for image read and edit
+import importlib  # heavy module load on first use
 import os  # file name and path handle
+import functools  # keep value for later call
+import queue  # pass work result back to gui thread
+import threading  # render work out of gui thread
+import tempfile  # scratch folder for old undo step
+import stat  # file mode of saved file
+import shutil  # remove scratch folder
+import atexit  # clean scratch when program end
+import sys  # command line argument
+import json  # recipe file
+import argparse  # batch command line
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import wait, as_completed, FIRST_COMPLETED
+from collections import OrderedDict, deque  # lru cache of view tiles
+import contextlib  # trace span as with block
+import hashlib  # thumbnail cache file name
+import struct  # session file trailer
+import math  # tile grid round up
+import itertools  # id number for history state
+import platform  # machine info in benchmark report
+import tracemalloc  # count memory made by benchmark op
+
+try:
+    import resource  # peak memory of process, not on windows
+except ImportError:
+    resource = None
+
+
+# module that is imported when first used, window show before they load
+class LazyModule:
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """import module now, safe from any thread"""
+        if self.module is None:
+            with self.lock:
+                if self.module is None:
+                    self.module = importlib.import_module(self.name)
+        return self.module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+cv2 = LazyModule("cv2")  # use for image read and edit
+np = LazyModule("numpy")  # image pixel array
+Image = LazyModule("PIL.Image")  # image show inside gui
+ImageTk = LazyModule("PIL.ImageTk")
+GifImagePlugin = LazyModule("PIL.GifImagePlugin")  # gif written frame by frame
+TiffImagePlugin = LazyModule("PIL.TiffImagePlugin")
+
+
+def warm_modules(on_done=None):
+    """import heavy modules on background thread, first load is not slow"""
+
+    def work():
+        start = time.perf_counter()
+        for module in (np, cv2, Image, ImageTk):
+            module.load()
+        if on_done is not None:
+            on_done(time.perf_counter() - start)
+
+    threading.Thread(target=work, name="warm-modules", daemon=True).start()
+
+
+TRACE_EVENTS = 100_000  # last trace event kept while recording, old one drop out
+
+
+# timing of each stage, export as chrome trace_event json (chrome://tracing)
+class Tracer:
+    def __init__(self, size=TRACE_EVENTS):
+        # off until gui ask, batch and watch never pay for it
+        self.enabled = False  # span is timed, for overlay and recording
+        self.recording = False  # event is kept for export
+        self.events = deque(maxlen=size)
+        self.threads = {}  # thread id -> name, for trace viewer row label
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.pending = {}  # stage -> ms since last shown frame
+        self.last_frame = {}  # stage -> ms of last shown frame
+        self.frames = 0
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        """time the with block as one stage"""
+        if not self.enabled:
+            yield
+            return
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, begin, time.perf_counter(), args)
+
+    def add(self, name, begin, end, args=None):
+        """keep one complete event, safe from any thread"""
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": "app",
+            "ph": "X",
+            "ts": (begin - self.origin) * 1e6,
+            "dur": (end - begin) * 1e6,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+        }
+        if args:
+            event["args"] = args
+        with self.lock:
+            if self.recording:
+                self.events.append(event)
+                self.threads[thread.ident] = thread.name
+            self.pending[name] = self.pending.get(name, 0.0) + (end - begin) * 1000
+
+    def configure(self, overlay, recording):
+        """time spans while overlay or recording is on, new recording start
+        with no old event"""
+        with self.lock:
+            if recording and not self.recording:
+                self.events.clear()
+                self.threads.clear()
+            self.recording = recording
+            self.enabled = overlay or recording
+
+    def end_frame(self):
+        """stage time since last call is the last frame timing now"""
+        with self.lock:
+            self.last_frame, self.pending = self.pending, {}
+            self.frames += 1
+
+    def frame_summary(self, count=5):
+        """short text of slowest stage of last frame"""
+        with self.lock:
+            stages = sorted(self.last_frame.items(), key=lambda item: -item[1])
+        if not stages:
+            return ""
+        text = " | ".join(f"{name} {ms:.1f}" for name, ms in stages[:count])
+        return f"{text} ms"
+
+    def export(self, path):
+        """write chrome trace_event json, return event count"""
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        pid = os.getpid()
+        names = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in threads.items()
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": names + events, "displayTimeUnit": "ms"}, f)
+        return len(events)
+
+
+TRACER = Tracer()
+
+# smallest side of the last proxy level, smaller than this is useless for canvas
+PROXY_MIN_SIDE = 256
+
+
+def build_pyramid(image, min_side=PROXY_MIN_SIDE):
+    """make list of half size copy of image, level 0 is the full image"""
+    levels = [image]
+    with TRACER.span("pyramid"):
+        while min(levels[-1].shape[:2]) // 2 >= min_side:
+            height, width = levels[-1].shape[:2]
+            levels.append(
+                cv2.resize(
+                    levels[-1], (width // 2, height // 2), interpolation=cv2.INTER_AREA
+                )
+            )
+    return levels
+
+
+def pick_level(pyramid, width, height):
+    """take smallest level that still fill the canvas size"""
+    for level in reversed(pyramid):
+        level_height, level_width = level.shape[:2]
+        if level_width >= width or level_height >= height:
+            return level
+    return pyramid[0]
+
+
+def resize_op(image, percentage):
+    """resize by percent of the size"""
+    height, width = image.shape[:2]
+    new_width = max(1, int(width * percentage / 100))
+    new_height = max(1, int(height * percentage / 100))
+    return cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
+
+
+def brightness_lut(brightness):
+    """same as convertScaleAbs with alpha 1, negative value come back as abs"""
+    return np.abs(np.arange(256) + brightness)
+
+
+def contrast_lut(contrast):
+    """contrast -100 to 100, stretch pixel away from middle gray"""
+    return (np.arange(256) - 128) * (1 + contrast / 100) + 128
+
+
+def gamma_lut(gamma):
+    """gamma over 1 make dark part brighter"""
+    return 255 * (np.arange(256) / 255) ** (1 / gamma)
+
+
+# edit that change every pixel alone, many of them can run as one lut
+POINTWISE_LUTS = {
+    "brightness": brightness_lut,
+    "contrast": contrast_lut,
+    "gamma": gamma_lut,
+}
+
+
+def compile_lut(steps):
+    """join pointwise steps into one 256 table, round every step like uint8"""
+    lut = np.arange(256, dtype=np.uint8)
+    for step in steps:
+        values = POINTWISE_LUTS[step["op"]](step["value"])
+        lut = np.clip(np.rint(values), 0, 255).astype(np.uint8)[lut]
+    return lut
+
+
+def brightness_op(image, brightness):
+    """add brightness value to every pixel"""
+    return cv2.LUT(image, compile_lut([{"op": "brightness", "value": brightness}]))
+
+
+def contrast_op(image, contrast):
+    """change contrast"""
+    return cv2.LUT(image, compile_lut([{"op": "contrast", "value": contrast}]))
+
+
+def gamma_op(image, gamma):
+    """change gamma"""
+    return cv2.LUT(image, compile_lut([{"op": "gamma", "value": gamma}]))
+
+
+def crop_op(image, box):
+    """cut box (x1, y1, x2, y2) from image, box is clamped inside image"""
+    img_height, img_width = image.shape[:2]
+    x1, y1, x2, y2 = (int(v) for v in box)
+    x1, x2 = max(0, x1), min(img_width, x2)
+    y1, y2 = max(0, y1), min(img_height, y2)
+    return image[y1:y2, x1:x2]
+
+
+# spatial filters, scale is pixel size compared to full size (proxy is < 1)
+SHARPEN_SIGMA = 1.0  # blur radius that sharpen take away, full size pixel
+DENOISE_DIAMETER = 9  # bilateral filter window, full size pixel
+LOCAL_CONTRAST_SIGMA = 24.0  # big radius unsharp mask, full size pixel
+FILTER_TILE = 512  # tile side of parallel filter, without halo
+
+
+def gaussian_halo(sigma):
+    """pixel around tile that gaussian of this sigma read, opencv kernel is
+    6 sigma + 1 wide"""
+    return math.ceil(3 * sigma) + 1
+
+
+def blur_filter(image, sigma, scale=1.0):
+    return cv2.GaussianBlur(image, (0, 0), max(0.3, sigma * scale))
+
+
+def blur_halo(sigma, scale=1.0):
+    return gaussian_halo(max(0.3, sigma * scale))
+
+
+def unsharp(image, amount, sigma):
+    """image + amount * (image - blurred image)"""
+    blurred = cv2.GaussianBlur(image, (0, 0), max(0.3, sigma))
+    return cv2.addWeighted(image, 1 + amount, blurred, -amount, 0)
+
+
+def sharpen_filter(image, percent, scale=1.0):
+    return unsharp(image, percent / 100, SHARPEN_SIGMA * scale)
+
+
+def sharpen_halo(percent, scale=1.0):
+    return gaussian_halo(max(0.3, SHARPEN_SIGMA * scale))
+
+
+def denoise_diameter(scale):
+    return max(3, round(DENOISE_DIAMETER * scale) | 1)
+
+
+def denoise_filter(image, strength, scale=1.0):
+    """edge keeping smooth, strength is color difference that is smoothed"""
+    diameter = denoise_diameter(scale)
+    return cv2.bilateralFilter(image, diameter, strength, diameter / 2)
+
+
+def denoise_halo(strength, scale=1.0):
+    return denoise_diameter(scale) // 2 + 1
+
+
+def local_contrast_filter(image, percent, scale=1.0):
+    return unsharp(image, percent / 100, LOCAL_CONTRAST_SIGMA * scale)
+
+
+def local_contrast_halo(percent, scale=1.0):
+    return gaussian_halo(max(0.3, LOCAL_CONTRAST_SIGMA * scale))
+
+
+# filter name -> (function, halo function), both take (value, scale)
+FILTERS = {
+    "denoise": (denoise_filter, denoise_halo),
+    "blur": (blur_filter, blur_halo),
+    "sharpen": (sharpen_filter, sharpen_halo),
+    "local_contrast": (local_contrast_filter, local_contrast_halo),
+}
+
+
+# cv2 thread count is for whole process, so users inside share one setting
+class OpenCVThreads:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+        self.saved = None  # thread count before first user came in
+
+    @contextlib.contextmanager
+    def single(self):
+        """cv2 call run on calling thread only, last one out restore count"""
+        with self.lock:
+            if self.users == 0:
+                self.saved = cv2.getNumThreads()
+                cv2.setNumThreads(1)
+            self.users += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.users -= 1
+                if self.users == 0:
+                    cv2.setNumThreads(self.saved)
+
+
+CV2_THREADS = OpenCVThreads()
+
+
+# run filter on tiles with halo on thread pool, result same as one full call
+class TileFilterEngine:
+    def __init__(self, workers=None, tile=FILTER_TILE):
+        self.tile = tile
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="filter"
+        )
+
+    def run(self, image, name, value, scale=1.0):
+        """filter whole image, tile is read with halo so there is no seam"""
+        func, halo_of = FILTERS[name]
+        halo = halo_of(value, scale)
+        tile = max(self.tile, 4 * halo)  # halo is small part of work
+        height, width = image.shape[:2]
+        if self.workers == 1 or (height <= tile and width <= tile):
+            return func(image, value, scale)
+
+        out = np.empty_like(image)
+        # tile threads are the parallel part, cv2 pool in each would fight them
+        with CV2_THREADS.single():
+            jobs = [
+                self.pool.submit(
+                    self.run_tile, image, out, func, value, scale, halo, y, x, tile
+                )
+                for y in range(0, height, tile)
+                for x in range(0, width, tile)
+            ]
+            for job in jobs:
+                job.result()  # raise error of worker here
+        return out
+
+    @staticmethod
+    def run_tile(image, out, func, value, scale, halo, y, x, tile):
+        """filter one tile with halo around it, write only the middle part"""
+        height, width = image.shape[:2]
+        y0, x0 = max(0, y - halo), max(0, x - halo)
+        y1, x1 = min(height, y + tile), min(width, x + tile)
+        result = func(
+            image[y0 : min(height, y1 + halo), x0 : min(width, x1 + halo)],
+            value,
+            scale,
+        )
+        out[y:y1, x:x1] = result[y - y0 : y1 - y0, x - x0 : x1 - x0]
+
+    def speedup(self, image, name, value, scale=1.0, repeat=3):
+        """time tiled run against one full frame call on one thread, best
+        of repeat"""
+        func = FILTERS[name][0]
+        single = tiled = float("inf")
+        for _ in range(repeat):
+            with CV2_THREADS.single():
+                start = time.perf_counter()
+                expected = func(image, value, scale)
+                single = min(single, time.perf_counter() - start)
+            start = time.perf_counter()
+            result = self.run(image, name, value, scale)
+            tiled = min(tiled, time.perf_counter() - start)
+        return {
+            "single_ms": single * 1000,
+            "tiled_ms": tiled * 1000,
+            "speedup": single / max(tiled, 1e-9),
+            "same": bool(np.array_equal(expected, result)),
+        }
+
+
+FILTER_ENGINE = TileFilterEngine()
+
+
+def filter_op(name):
+    """edit op function of filter, run on the shared tile engine"""
+
+    def op(image, value, scale=1.0):
+        return FILTER_ENGINE.run(image, name, value, scale)
+
+    return op
+
+
+# edit name to function, same name is "op" in batch recipe file
+EDIT_OPS = {
+    "resize": resize_op,
+    "brightness": brightness_op,
+    "contrast": contrast_op,
+    "gamma": gamma_op,
+    "crop": crop_op,
+}
+EDIT_OPS.update((name, filter_op(name)) for name in FILTERS)
+
+
+# output array reused by preview render, no new full frame every slider move
+class BufferPool:
+    def __init__(self, count=2):
+        """count buffer used in turn, shown frame is not written next time"""
+        self.count = count
+        self.key = None
+        self.arrays = []
+        self.next = 0
+
+    def get(self, shape, dtype):
+        if self.key != (shape, dtype):
+            self.key = (shape, dtype)
+            self.arrays = [np.empty(shape, dtype) for _ in range(self.count)]
+        self.next = (self.next + 1) % self.count
+        return self.arrays[self.next]
+
+
+def run_pipeline(image, steps, pool=None):
+    """run steps in order, pointwise steps next to each other is one lut pass"""
+    owned = False  # True when image is new array made here, safe to write
+    index = 0
+    while index < len(steps):
+        step = steps[index]
+        if step["op"] not in POINTWISE_LUTS:
+            with TRACER.span(step["op"]):
+                if "scale" in step:  # filter on proxy, radius is full size pixel
+                    image = EDIT_OPS[step["op"]](
+                        image, step["value"], scale=step["scale"]
+                    )
+                else:
+                    image = EDIT_OPS[step["op"]](image, step["value"])
+            owned = step["op"] != "crop"  # crop give a view of input
+            index += 1
+            continue
+
+        group = []
+        while index < len(steps) and steps[index]["op"] in POINTWISE_LUTS:
+            group.append(steps[index])
+            index += 1
+        if owned:
+            out = image  # write lut result in same array
+        elif pool is not None:
+            out = pool.get(image.shape, image.dtype)
+        else:
+            out = None
+        with TRACER.span("lut", ops="+".join(step["op"] for step in group)):
+            image = cv2.LUT(image, compile_lut(group), dst=out)
+        owned = True
+    return image
+
+
+def apply_recipe(image, recipe):
+    """run list of {"op": name, "value": value} on image"""
+    return run_pipeline(image, recipe)
+
+
+def load_recipe(path):
+    """read recipe json file and check op names"""
+    with open(path) as f:
+        recipe = json.load(f)
+    if not isinstance(recipe, list):
+        raise ValueError("recipe must be a list of steps")
+    for step in recipe:
+        if not isinstance(step, dict) or step.get("op") not in EDIT_OPS:
+            raise ValueError(f"bad recipe step: {step}")
+        if "value" not in step or not recipe_value_ok(step["op"], step["value"]):
+            raise ValueError(f"bad value in recipe step: {step}")
+        if "scale" in step and not is_number(step["scale"]):
+            raise ValueError(f"bad scale in recipe step: {step}")
+    return recipe
+
+
+def is_number(value):
+    """int or float, json true and false are not"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def recipe_value_ok(op, value):
+    """crop take [x1, y1, x2, y2], resize and gamma a positive number, rest
+    any number"""
+    if op == "crop":
+        return (
+            isinstance(value, list)
+            and len(value) == 4
+            and all(isinstance(v, int) and not isinstance(v, bool) for v in value)
+        )
+    if not is_number(value):
+        return False
+    if op in ("resize", "gamma"):
+        return value > 0
+    return True
+
+
+# slider edit order and value that mean no change
+EDIT_ORDER = (
+    "resize",
+    "denoise",
+    "blur",
+    "sharpen",
+    "local_contrast",
+    "brightness",
+    "contrast",
+    "gamma",
+)
+SLIDER_NEUTRAL = {
+    "resize": 100,
+    "denoise": 0,
+    "blur": 0,
+    "sharpen": 0,
+    "local_contrast": 0,
+    "brightness": 0,
+    "contrast": 0,
+    "gamma": 1.0,
+}
+EDIT_LABELS = {
+    "resize": "Resized to {:.0f}%",
+    "denoise": "Denoise: {:.0f}",
+    "blur": "Blur: {:.1f}",
+    "sharpen": "Sharpen: {:.0f}%",
+    "local_contrast": "Local contrast: {:.0f}%",
+    "brightness": "Brightness adjusted: {:.0f}",
+    "contrast": "Contrast: {:.0f}",
+    "gamma": "Gamma: {:.2f}",
+}
+
+# how much undo can keep in memory and scratch file, old step removed after
+HISTORY_BUDGET = 4 * 1024 * 1024 * 1024
+# after this much in memory, old step move to scratch file on disk
+HISTORY_RAM_LIMIT = 512 * 1024 * 1024
+HISTORY_TILE = 256  # tile side in pixel
+SCRATCH_PREFIX = "imgapp-scratch-"  # name start of scratch folder in temp
+
+
+def pid_alive(pid):
+    """True if process with this pid still run"""
+    if os.name == "nt":
+        import ctypes
+
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def clean_stale_scratch():
+    """remove scratch folder left by program that crash"""
+    temp_dir = tempfile.gettempdir()
+    for name in os.listdir(temp_dir):
+        if not name.startswith(SCRATCH_PREFIX):
+            continue
+        path = os.path.join(temp_dir, name)
+        try:
+            with open(os.path.join(path, "owner.pid")) as f:
+                pid = int(f.read().strip())
+        except (OSError, ValueError):
+            pid = None
+        if pid is None or not pid_alive(pid):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+SCRATCH_DIRS = set()  # scratch folder of histories not closed yet
+
+
+@atexit.register
+def remove_scratch_dirs():
+    """remove scratch of histories still open when program end, registry
+    keep only path so closed history is not kept alive"""
+    for path in list(SCRATCH_DIRS):
+        shutil.rmtree(path, ignore_errors=True)
+    SCRATCH_DIRS.clear()
+
+
+# run preview render on other thread, old request is dropped
+class RenderWorker:
+    def __init__(self, post):
+        """start worker thread, post run a function on gui thread"""
+        self.post = post
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.job = None  # only newest waiting job is kept
+        self.generation = 0  # bump on every submit, old result is stale
+        self.dropped = 0
+        self.delivered = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, render, on_done, on_error=None):
+        """ask for new render, replace the one still waiting"""
+        with self.lock:
+            self.generation += 1
+            if self.job is not None:
+                self.dropped += 1
+            self.job = (self.generation, render, on_done, on_error)
+        self.wakeup.set()
+
+    def cancel(self):
+        """forget waiting job and result of running job"""
+        with self.lock:
+            self.generation += 1
+            if self.job is not None:
+                self.dropped += 1
+                self.job = None
+
+    def run(self):
+        """worker loop, opencv free the GIL so gui still move"""
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                job = self.job
+                self.job = None
+                self.wakeup.clear()
+            if job is None:
+                continue
+
+            generation, render, on_done, on_error = job
+            try:
+                result = render()
+            except Exception as e:
+                if on_error is not None:
+                    self.post(functools.partial(self.deliver, generation, e, on_error))
+                continue
+            self.post(functools.partial(self.deliver, generation, result, on_done))
+
+    def deliver(self, generation, result, callback):
+        """run on gui thread, skip result if newer request come"""
+        if generation != self.generation:
+            self.dropped += 1
+            return
+        self.delivered += 1
+        callback(result)
+
+    def stats(self):
+        """short text for status bar"""
+        return f"renders: {self.delivered} shown, {self.dropped} dropped"
+
+
+def state_bytes(state):
+    """size of full image of a history state"""
+    return int(np.prod(state["shape"])) * np.dtype(state["dtype"]).itemsize
+
+
+# every history state in the program get different id, display cache use it
+STATE_IDS = itertools.count()
+
+
+def join_tiles(tiles, shape, dtype, tile_size):
+    """put tiles back in one new array"""
+    frame = np.empty(shape, dtype)
+    for (y, x), tile in tiles.items():
+        frame[y : y + tile_size, x : x + tile_size] = tile
+    return frame
+
+
+# undo history cut in tiles, tile that not change is shared between states
+class TileHistory:
+    def __init__(
+        self,
+        budget_bytes=HISTORY_BUDGET,
+        tile_size=HISTORY_TILE,
+        ram_limit=HISTORY_RAM_LIMIT,
+    ):
+        """empty history, budget is max bytes of memory and scratch together"""
+        self.budget_bytes = budget_bytes
+        self.ram_limit = ram_limit  # None mean never use scratch file
+        self.tile_size = tile_size
+        self.states = []  # each state is dict with id, shape and tiles
+        self.position = -1
+        self.tile_refs = {}  # id(tile) -> [how many state use it, bytes]
+        self.nbytes = 0  # bytes of different tiles, shared tile count one time
+        self.disk_bytes = 0  # bytes of states moved to scratch file
+        self.scratch_dir = None
+
+        # current state put together in one array, undo only fix tiles in it
+        self.frame = None
+        self.frame_tiles = None
+        self.frame_owned = False  # False when frame is array from outside
+
+    def __len__(self):
+        return len(self.states)
+
+    def tile_keys(self, shape):
+        """top left corner of every tile"""
+        for y in range(0, shape[0], self.tile_size):
+            for x in range(0, shape[1], self.tile_size):
+                yield y, x
+
+    def reset(self, image, meta=None):
+        """start new history with only this image"""
+        for state in self.states:
+            self.release(state)
+        self.states = []
+        self.position = -1
+        self.push(image, meta)
+
+    def cut_tiles(self, image, previous=None):
+        """image in read only tiles, tile same as in previous state is shared"""
+        if previous is not None and previous["tiles"] is None:
+            previous = None  # it is in scratch file, keep new one in memory
+        if previous is not None and previous["shape"] != image.shape:
+            previous = None  # crop change size, nothing to share
+
+        size = self.tile_size
+        tiles = {}
+        for y, x in self.tile_keys(image.shape):
+            block = image[y : y + size, x : x + size]
+            old = previous["tiles"][(y, x)] if previous is not None else None
+            if old is not None and np.array_equal(old, block):
+                tiles[(y, x)] = old  # same pixel, share old tile
+            else:
+                tile = block.copy()
+                tile.flags.writeable = False
+                tiles[(y, x)] = tile
+        return tiles
+
+    def new_state(self, shape, dtype, meta=None):
+        state = {"id": next(STATE_IDS), "shape": shape, "dtype": np.dtype(dtype)}
+        state["meta"] = meta  # recipe from source that make this state
+        state["tiles"] = None
+        state["file"] = None  # scratch file path when moved out of memory
+        state["offset"] = 0  # where pixel start in file
+        state["external"] = False  # file is not ours, never remove it
+        state["build"] = None  # function that make pixel on first use
+        state["mapped"] = None
+        return state
+
+    def push(self, image, meta=None):
+        """add image as new step, remove redo steps after position,
+        meta is kept with the step (recipe for session file)"""
+        while len(self.states) > self.position + 1:
+            self.release(self.states.pop())
+
+        previous = self.states[self.position] if self.position >= 0 else None
+        tiles = self.cut_tiles(image, previous)
+
+        state = self.new_state(image.shape, image.dtype, meta)
+        state["tiles"] = tiles
+        self.retain(state)
+        self.states.append(state)
+        self.position = len(self.states) - 1
+
+        # pushed image is the frame now, copy it first time undo change it
+        self.frame = image
+        self.frame_tiles = tiles
+        self.frame_owned = False
+
+        self.evict()
+        self.spill()
+
+    def retain(self, state):
+        """count tiles of new state"""
+        for tile in state["tiles"].values():
+            ref = self.tile_refs.get(id(tile))
+            if ref is None:
+                self.tile_refs[id(tile)] = [1, tile.nbytes]
+                self.nbytes += tile.nbytes
+            else:
+                ref[0] += 1
+
+    def release(self, state):
+        """forget tiles of removed state, free bytes if no state use it"""
+        if state["tiles"] is None:
+            state["mapped"] = None
+            if state["external"] or state["file"] is None:
+                return  # session file or not built yet, nothing of ours
+            self.disk_bytes -= state_bytes(state)
+            try:
+                os.remove(state["file"])
+            except OSError:
+                pass  # still open on windows, folder is removed at exit
+            return
+        for tile in state["tiles"].values():
+            ref = self.tile_refs[id(tile)]
+            ref[0] -= 1
+            if ref[0] == 0:
+                del self.tile_refs[id(tile)]
+                self.nbytes -= ref[1]
+
+    def evict(self):
+        """remove oldest steps until memory is inside budget"""
+        while self.nbytes + self.disk_bytes > self.budget_bytes and self.position > 0:
+            self.release(self.states.pop(0))
+            self.position -= 1
+
+    def scratch(self):
+        """make scratch folder first time it is needed"""
+        if self.scratch_dir is None:
+            self.scratch_dir = tempfile.mkdtemp(prefix=SCRATCH_PREFIX)
+            with open(os.path.join(self.scratch_dir, "owner.pid"), "w") as f:
+                f.write(str(os.getpid()))
+            SCRATCH_DIRS.add(self.scratch_dir)
+        return self.scratch_dir
+
+    def spill(self):
+        """move oldest states to scratch file until memory is under limit"""
+        if self.ram_limit is None:
+            return
+        for index, state in enumerate(self.states):
+            if self.nbytes <= self.ram_limit:
+                break
+            if index == self.position or state["tiles"] is None:
+                continue
+            self.spill_state(state)
+
+    def spill_state(self, state):
+        """write one state in scratch file and free its tiles"""
+        path = os.path.join(self.scratch(), f"state_{state['id']}.raw")
+        size = self.tile_size
+        mapped = np.memmap(path, dtype=state["dtype"], mode="w+", shape=state["shape"])
+        for (y, x), tile in state["tiles"].items():
+            mapped[y : y + size, x : x + size] = tile
+        mapped.flush()
+        del mapped
+
+        self.release(state)
+        state["tiles"] = None
+        state["file"] = path
+        self.disk_bytes += state_bytes(state)
+
+    def park(self):
+        """move every state with current one to scratch file, for document
+        that is not used now, current() map it back when needed"""
+        for state in self.states:
+            if state["tiles"] is not None:
+                self.spill_state(state)
+        self.frame = None
+        self.frame_tiles = None
+        self.frame_owned = False
+
+    def close(self):
+        """remove all states and the scratch folder"""
+        for state in self.states:
+            self.release(state)
+        self.states = []
+        self.position = -1
+        self.frame = None
+        self.frame_tiles = None
+        if self.scratch_dir is not None:
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
+            SCRATCH_DIRS.discard(self.scratch_dir)
+            self.scratch_dir = None
+
+    def current(self):
+        """image of current step, read only"""
+        if self.position < 0:
+            return None
+        state = self.states[self.position]
+        if state["build"] is not None:
+            # state from session file without pixel, make it first time
+            state["tiles"] = self.cut_tiles(state["build"]())
+            state["build"] = None
+            self.retain(state)
+            self.evict()
+            self.spill()
+        if state["tiles"] is None:
+            # map scratch file, page is read only when somebody touch it
+            if state["mapped"] is None:
+                state["mapped"] = np.memmap(
+                    state["file"],
+                    dtype=state["dtype"],
+                    mode="r",
+                    offset=state["offset"],
+                    shape=state["shape"],
+                )
+            self.frame = state["mapped"]
+            self.frame_tiles = None
+            self.frame_owned = False
+            return self.frame
+        if self.frame_tiles is state["tiles"]:
+            return self.frame
+
+        size = self.tile_size
+        if (
+            self.frame is None
+            or not self.frame_owned
+            or self.frame.shape != state["shape"]
+            or self.frame.dtype != state["dtype"]
+        ):
+            self.frame = np.empty(state["shape"], state["dtype"])
+            self.frame_tiles = {}
+            self.frame_owned = True
+
+        # write only tiles that is different from what frame have now
+        self.frame.flags.writeable = True
+        for key, tile in state["tiles"].items():
+            if self.frame_tiles.get(key) is not tile:
+                y, x = key
+                self.frame[y : y + size, x : x + size] = tile
+        self.frame.flags.writeable = False
+        self.frame_tiles = state["tiles"]
+        return self.frame
+
+    def load(self, states, position):
+        """start history from states made by new_state(), like from session"""
+        self.close()
+        self.states = list(states)
+        self.position = position
+        for state in self.states:
+            if state["tiles"] is not None:
+                self.retain(state)
+
+    def meta(self, index=None):
+        """meta of current step, or of step at index"""
+        if self.position < 0:
+            return None
+        return self.states[self.position if index is None else index]["meta"]
+
+    def pixels(self, index):
+        """function that give image of step at index, for other thread,
+        None when step is not made yet"""
+        state = self.states[index]
+        if index == self.position:
+            return self.snapshot()
+        if state["tiles"] is not None:
+            return functools.partial(
+                join_tiles,
+                state["tiles"],
+                state["shape"],
+                state["dtype"],
+                self.tile_size,
+            )
+        if state["file"] is None:
+            return None
+        mapped = np.memmap(
+            state["file"],
+            dtype=state["dtype"],
+            mode="r",
+            offset=state["offset"],
+            shape=state["shape"],
+        )
+        return lambda: mapped
+
+    def snapshot(self):
+        """function that give current image, safe to call from other thread"""
+        state = self.states[self.position]
+        if state["build"] is not None:
+            self.current()  # make its tiles first
+        if state["tiles"] is None:
+            frame = self.current()  # scratch file is never written again
+            return lambda: frame
+        if not self.frame_owned and self.frame_tiles is state["tiles"]:
+            frame = self.frame  # array from outside, undo never write in it
+            return lambda: frame
+        return functools.partial(
+            join_tiles, state["tiles"], state["shape"], state["dtype"], self.tile_size
+        )
+
+    def current_id(self):
+        """id of current step, change when image change"""
+        if self.position < 0:
+            return None
+        return self.states[self.position]["id"]
+
+    def can_undo(self):
+        return self.position > 0
+
+    def can_redo(self):
+        return self.position < len(self.states) - 1
+
+    def undo(self):
+        """go back one step, return False if nothing"""
+        if not self.can_undo():
+            return False
+        self.position -= 1
+        return True
+
+    def redo(self):
+        """go forward one step, return False if nothing"""
+        if not self.can_redo():
+            return False
+        self.position += 1
+        return True
+
+
+VIEW_TILE = 256  # side of one screen tile in zoom mode
+VIEW_CACHE_BYTES = 128 * 1024 * 1024  # max bytes of screen tiles kept
+VIEW_MAX_ZOOM = 8.0  # screen pixel for one image pixel at most
+
+
+# keep newest used tiles until byte limit, oldest is thrown away
+class TileCache:
+    def __init__(self, max_bytes=VIEW_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()
+        self.nbytes = 0
+
+    def get(self, key):
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+        return tile
+
+    def put(self, key, tile):
+        old = self.tiles.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self.tiles[key] = tile
+        self.nbytes += tile.nbytes
+        while self.nbytes > self.max_bytes and len(self.tiles) > 1:
+            _, removed = self.tiles.popitem(last=False)
+            self.nbytes -= removed.nbytes
+
+    def clear(self):
+        self.tiles.clear()
+        self.nbytes = 0
+
+
+def display_rgb(image):
+    """image keep opencv BGR order everywhere, only screen size buffer
+    given to PIL is turned to RGB"""
+    with TRACER.span("cvtColor"):
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def render_view_tile(pyramid, full_width, zoom, col, row, tile=VIEW_TILE):
+    """make one screen tile, zoom is screen pixel per full size pixel"""
+    # smallest level that still have enough pixel for this zoom
+    level = pyramid[0]
+    for candidate in pyramid:
+        if candidate.shape[1] / full_width >= zoom:
+            level = candidate
+    factor = zoom / (level.shape[1] / full_width)  # level pixel to screen pixel
+
+    view_width = int(level.shape[1] * factor)
+    view_height = int(level.shape[0] * factor)
+    x0, y0 = col * tile, row * tile
+    x1, y1 = min(x0 + tile, view_width), min(y0 + tile, view_height)
+    if x1 <= x0 or y1 <= y0:
+        return None
+
+    source = level[
+        int(y0 / factor) : max(int(y0 / factor) + 1, math.ceil(y1 / factor)),
+        int(x0 / factor) : max(int(x0 / factor) + 1, math.ceil(x1 / factor)),
+    ]
+    interpolation = cv2.INTER_AREA if factor < 1 else cv2.INTER_NEAREST
+    with TRACER.span("view tile"):
+        return cv2.resize(source, (x1 - x0, y1 - y0), interpolation=interpolation)
+
+
+# zoom and pan view on a canvas, only tiles inside the window is made
+class TileViewer:
+    def __init__(self, canvas, cache, name):
+        self.canvas = canvas
+        self.cache = cache
+        self.name = name  # cache key part, two viewer share one cache
+        self.pyramid = None
+        self.full_width = 1
+        self.version = 0  # change when new image is shown
+        self.zoom = 1.0
+        self.offset_x = 0  # screen pixel of image at left top of canvas
+        self.offset_y = 0
+        self.items = {}  # (col, row) -> (canvas item, photo)
+        self.pan_start = None
+
+    def show(self, pyramid, full_width=None, keep_view=True):
+        """show new image, zoom stay same when keep_view"""
+        first = self.pyramid is None
+        self.pyramid = pyramid
+        self.full_width = full_width or pyramid[0].shape[1]
+        self.version += 1
+        self.clear_items()
+        if first or not keep_view:
+            self.zoom = self.fit_zoom()
+            self.offset_x = self.offset_y = 0
+        self.redraw()
+
+    def full_size(self):
+        scale = self.full_width / self.pyramid[0].shape[1]
+        return self.full_width, self.pyramid[0].shape[0] * scale
+
+    def canvas_size(self):
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width <= 1 or height <= 1:
+            return 500, 500
+        return width, height
+
+    def fit_zoom(self):
+        width, height = self.canvas_size()
+        full_width, full_height = self.full_size()
+        return min(width / full_width, height / full_height)
+
+    def clamp(self):
+        """do not pan image out of window"""
+        width, height = self.canvas_size()
+        full_width, full_height = self.full_size()
+        max_x = max(0, int(full_width * self.zoom) - width)
+        max_y = max(0, int(full_height * self.zoom) - height)
+        self.offset_x = min(max(0, self.offset_x), max_x)
+        self.offset_y = min(max(0, self.offset_y), max_y)
+
+    def zoom_at(self, factor, x, y):
+        """zoom with point x, y of canvas staying under mouse"""
+        if self.pyramid is None:
+            return
+        new_zoom = min(max(self.zoom * factor, self.fit_zoom()), VIEW_MAX_ZOOM)
+        image_x = (self.offset_x + x) / self.zoom
+        image_y = (self.offset_y + y) / self.zoom
+        self.zoom = new_zoom
+        self.offset_x = int(image_x * new_zoom - x)
+        self.offset_y = int(image_y * new_zoom - y)
+        self.clear_items()  # old zoom tile is wrong size
+        self.redraw()
+
+    def start_pan(self, event):
+        self.pan_start = (event.x, event.y)
+
+    def pan(self, event):
+        if self.pyramid is None or self.pan_start is None:
+            return
+        self.offset_x -= event.x - self.pan_start[0]
+        self.offset_y -= event.y - self.pan_start[1]
+        self.pan_start = (event.x, event.y)
+        self.redraw()
+
+    def redraw(self):
+        """place visible tiles, make only the missing ones"""
+        if self.pyramid is None:
+            return
+        self.clamp()
+        width, height = self.canvas_size()
+        first_col, first_row = self.offset_x // VIEW_TILE, self.offset_y // VIEW_TILE
+        last_col = (self.offset_x + width - 1) // VIEW_TILE
+        last_row = (self.offset_y + height - 1) // VIEW_TILE
+
+        visible = set()
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                visible.add((col, row))
+                x = col * VIEW_TILE - self.offset_x
+                y = row * VIEW_TILE - self.offset_y
+                if (col, row) in self.items:
+                    self.canvas.coords(self.items[(col, row)][0], x, y)
+                    continue
+
+                key = (self.name, self.version, self.zoom, col, row)
+                tile = self.cache.get(key)
+                if tile is None:
+                    tile = render_view_tile(
+                        self.pyramid, self.full_width, self.zoom, col, row
+                    )
+                    if tile is None:
+                        continue
+                    tile = display_rgb(tile)  # cache keep it ready for PIL
+                    self.cache.put(key, tile)
+                photo = ImageTk.PhotoImage(image=Image.fromarray(tile))
+                item = self.canvas.create_image(x, y, image=photo, anchor=tk.NW)
+                self.items[(col, row)] = (item, photo)
+
+        for key in list(self.items):
+            if key not in visible:
+                self.canvas.delete(self.items.pop(key)[0])
+
+    def reset(self):
+        """forget image, next show start from fit zoom"""
+        self.clear_items()
+        self.pyramid = None
+
+    def clear_items(self):
+        for item, _ in self.items.values():
+            self.canvas.delete(item)
+        self.items = {}
+
+
+IO_CHUNK = 4 * 1024 * 1024  # read and write file in this size piece
+
+
+@functools.lru_cache(maxsize=None)
+def new_file_mode():
+    """mode open() give a new file, umask can only be read by setting it"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def replace_file(temp_path, path):
+    """rename temp file over path, mkstemp make it 0600 so first give it
+    mode of old file, or normal mode of new file"""
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = new_file_mode()
+    os.chmod(temp_path, mode)
+    os.replace(temp_path, path)
+
+
+class IOCancelled(Exception):
+    """file job stopped by user"""
+
+
+# handle of one file job, worker tell progress and check cancel here
+class IOTask:
+    def __init__(self, post, on_progress):
+        self.post = post
+        self.on_progress = on_progress
+        self.cancelled = threading.Event()
+        self.last_percent = -1
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check(self):
+        """stop the job here if cancel was asked"""
+        if self.cancelled.is_set():
+            raise IOCancelled()
+
+    def progress(self, fraction, text):
+        """send progress to gui, only when percent change"""
+        self.check()
+        percent = int(fraction * 100)
+        if percent != self.last_percent and self.on_progress is not None:
+            self.last_percent = percent
+            self.post(functools.partial(self.on_progress, percent, text))
+
+
+# load and save on thread pool so window not hang on big file
+class IOService:
+    def __init__(self, post, workers=2):
+        self.post = post
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, job, on_done, on_error, on_progress=None):
+        """run job(task) on pool, result or error come back on gui thread"""
+        task = IOTask(self.post, on_progress)
+
+        def run():
+            try:
+                result = job(task)
+            except Exception as e:
+                self.post(functools.partial(on_error, e))
+                return
+            self.post(functools.partial(on_done, result))
+
+        self.pool.submit(run)
+        return task
+
+
+def read_file_bytes(path, task=None):
+    """read whole file piece by piece into uint8 array, progress go to 80%"""
+    size = os.path.getsize(path)
+    data = np.empty(size, np.uint8)
+    view = memoryview(data)
+    with TRACER.span("read"), open(path, "rb") as f:
+        done = 0
+        while done < size:
+            count = f.readinto(view[done : done + IO_CHUNK])
+            if not count:
+                break
+            done += count
+            if task is not None:
+                task.progress(0.8 * done / max(size, 1), "Reading")
+    return data[:done]
+
+
+def decode_image(data, path, flags=None):
+    """decode file bytes, error tell the file name"""
+    if flags is None:
+        flags = cv2.IMREAD_COLOR
+    with TRACER.span("decode", flags=flags):
+        image = cv2.imdecode(data, flags)
+    if image is None:
+        raise ValueError(f"cannot read image {os.path.basename(path)}")
+    return image
+
+
+def read_image_file(path, task=None):
+    """read file piece by piece then decode, same result as cv2.imread"""
+    data = read_file_bytes(path, task)
+    if task is not None:
+        task.progress(0.8, "Decoding")
+    return decode_image(data, path)
+
+
+PREVIEW_MIN_SIDE = 1024  # long side of quick preview is at least this
+# jpeg decoder scale down inside the dct, so these are much faster than full
+REDUCED_FLAGS = {
+    2: "IMREAD_REDUCED_COLOR_2",
+    4: "IMREAD_REDUCED_COLOR_4",
+    8: "IMREAD_REDUCED_COLOR_8",
+}
+
+
+def reduced_factor(path, min_side=PREVIEW_MIN_SIDE):
+    """how much to scale down for quick preview, 1 when no preview is worth it"""
+    try:
+        with Image.open(path) as header:  # read only the header, no pixel
+            if header.format != "JPEG":
+                return 1  # other decoder read full image then resize, no gain
+            width, height = header.size
+    except Exception:
+        return 1
+    factor = 1
+    for candidate in sorted(REDUCED_FLAGS):
+        if max(width, height) // candidate >= min_side:
+            factor = candidate
+    return factor
+
+
+# encoder settings for save and export, cv2 flag is looked up when used
+EXPORT_PRESETS = {
+    "Balanced": {
+        "png_compression": 3,
+        "jpeg_quality": 92,
+        "jpeg_progressive": False,
+        "jpeg_optimize": True,
+        "webp_quality": 90,
+    },
+    "Fast save": {
+        "png_compression": 1,
+        "jpeg_quality": 95,
+        "jpeg_progressive": False,
+        "jpeg_optimize": False,
+        "webp_quality": 90,
+    },
+    "Small file": {
+        "png_compression": 9,
+        "jpeg_quality": 80,
+        "jpeg_progressive": True,
+        "jpeg_optimize": True,
+        "webp_quality": 75,
+    },
+    "Best quality": {
+        "png_compression": 6,
+        "jpeg_quality": 100,
+        "jpeg_progressive": False,
+        "jpeg_optimize": True,
+        "webp_quality": 101,  # above 100 is lossless webp
+    },
+}
+EXPORT_DEFAULT = "Balanced"
+EXPORT_FORMATS = ("png", "jpg", "webp")  # type that export can write together
+
+# preset key -> cv2 flag name, by file type
+ENCODER_FLAGS = {
+    ".png": (("png_compression", "IMWRITE_PNG_COMPRESSION"),),
+    ".jpg": (
+        ("jpeg_quality", "IMWRITE_JPEG_QUALITY"),
+        ("jpeg_progressive", "IMWRITE_JPEG_PROGRESSIVE"),
+        ("jpeg_optimize", "IMWRITE_JPEG_OPTIMIZE"),
+    ),
+    ".webp": (("webp_quality", "IMWRITE_WEBP_QUALITY"),),
+}
+ENCODER_FLAGS[".jpeg"] = ENCODER_FLAGS[".jpg"]
+
+
+def encode_params(path, preset=None):
+    """cv2 imwrite flag list for file type of path, empty is cv2 default"""
+    if isinstance(preset, str):
+        preset = EXPORT_PRESETS[preset]
+    params = []
+    for key, flag in ENCODER_FLAGS.get(os.path.splitext(path)[1].lower(), ()):
+        if preset and key in preset:
+            params += [getattr(cv2, flag), int(preset[key])]
+    return params
+
+
+def encode_image(ext, image, params=None):
+    """compressed file bytes of image as memoryview"""
+    with TRACER.span("encode"):
+        ok, buffer = cv2.imencode(ext, image, params or [])
+    if not ok:
+        raise ValueError(f"cannot encode {ext} file")
+    return memoryview(buffer.reshape(-1))
+
+
+def write_image_atomic(path, image, params=None, task=None):
+    """write to temp file then rename, half written file never have real name"""
+    if task is not None:
+        task.progress(0.0, "Encoding")
+    data = encode_image(os.path.splitext(path)[1], image, params)
+    return write_bytes_atomic(path, data, task)
+
+
+def write_bytes_atomic(path, data, task=None):
+    """write encoded data by temp file and rename, return byte count"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    ext = os.path.splitext(path)[1]
+    fd, temp_path = tempfile.mkstemp(prefix=".part-", suffix=ext, dir=directory)
+    try:
+        with TRACER.span("write"), os.fdopen(fd, "wb") as f:
+            for start in range(0, len(data), IO_CHUNK):
+                f.write(data[start : start + IO_CHUNK])
+                if task is not None:
+                    done = min(start + IO_CHUNK, len(data))
+                    task.progress(0.5 + 0.5 * done / len(data), "Writing")
+            f.flush()
+            os.fsync(f.fileno())
+        replace_file(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return len(data)
+
+
+def export_targets(base_path, formats, sizes):
+    """(path, percent) for every format and size, 100 percent keep plain name"""
+    stem = os.path.splitext(base_path)[0]
+    targets = []
+    for percent in sizes:
+        suffix = "" if percent == 100 else f"-{percent}"
+        for fmt in formats:
+            targets.append((f"{stem}{suffix}.{fmt.lstrip('.')}", percent))
+    return targets
+
+
+def export_one(path, image, params, task=None, write_progress=False):
+    """encode and write one export file, return report dict"""
+    if task is not None:
+        task.check()
+    start = time.perf_counter()
+    data = encode_image(os.path.splitext(path)[1], image, params)
+    encode_ms = (time.perf_counter() - start) * 1000
+    size = write_bytes_atomic(path, data, task if write_progress else None)
+    return {
+        "path": path,
+        "width": image.shape[1],
+        "height": image.shape[0],
+        "bytes": size,
+        "encode_ms": encode_ms,
+        "write_ms": (time.perf_counter() - start) * 1000 - encode_ms,
+    }
+
+
+def export_image(image, targets, preset=None, workers=None, task=None):
+    """write image to every (path, percent) target, encodes run on thread
+    pool since cv2 encoder let go of the gil, return report in target order"""
+    sized = {}  # each size is resized once for all its formats
+    for _, percent in targets:
+        if percent not in sized:
+            sized[percent] = image if percent == 100 else resize_op(image, percent)
+
+    reports = [None] * len(targets)
+    workers = min(workers or os.cpu_count() or 1, len(targets)) or 1
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export") as pool:
+        futures = {
+            pool.submit(
+                export_one, path, sized[percent], encode_params(path, preset), task
+            ): number
+            for number, (path, percent) in enumerate(targets)
+        }
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                reports[futures[future]] = future.result()
+                if task is not None:
+                    task.progress(done / len(targets), f"{done}/{len(targets)} files")
+        except BaseException:
+            for future in futures:
+                future.cancel()  # not started encode, running one finish
+            raise
+    return reports
+
+
+def export_summary(reports, seconds=None):
+    """short status text of export reports"""
+    parts = [
+        f"{os.path.basename(report['path'])} {report['bytes'] / 1024:.0f} KB "
+        f"{report['encode_ms']:.0f} ms"
+        for report in reports
+    ]
+    text = ", ".join(parts)
+    if seconds is not None and len(reports) > 1:
+        text = f"{len(reports)} files in {seconds * 1000:.0f} ms: {text}"
+    return text
+
+
+SESSION_MAGIC = b"IMGSESSION1\n"  # first bytes of session file
+SESSION_TRAILER = struct.Struct("<Q8s")  # index offset and end mark at file end
+SESSION_END = b"IMGSIDX\n"
+SESSION_ALIGN = 4096  # pixel block start on page so memmap is cheap
+SESSION_KEYFRAMES = 4  # history steps with pixel saved, besides current one
+
+
+def session_keyframes(history, count=SESSION_KEYFRAMES):
+    """step index that get pixel in session: current one, steps with no
+    recipe, and some spread over the rest; others are rebuilt by recipe"""
+    keyframes = {history.position}
+    keyframes.update(
+        index for index in range(len(history)) if history.meta(index) is None
+    )
+    rest = [index for index in range(len(history)) if history.meta(index)]
+    if rest:
+        step = max(1, len(rest) // count)
+        keyframes.update(rest[step - 1 :: step][:count])
+    return sorted(keyframes)
+
+
+def session_job(doc, path):
+    """function(task) that write doc as session file, arrays are picked
+    here on gui thread, file is written on io thread"""
+    history = doc.history
+    # block 0 is source pixel, then its proxy levels
+    blocks = [functools.partial(np.asarray, level) for level in doc.original_pyramid]
+    states = []
+    keyframes = session_keyframes(history)
+    for index, state in enumerate(history.states):
+        entry = {
+            "shape": list(state["shape"]),
+            "dtype": state["dtype"].str,
+            "recipe": state["meta"],
+            "block": None,
+        }
+        pixels = history.pixels(index) if index in keyframes else None
+        if pixels is not None:
+            entry["block"] = len(blocks)
+            blocks.append(pixels)
+        states.append(entry)
+    header = {
+        "version": 1,
+        "source": os.path.abspath(doc.path),
+        "original": list(range(len(doc.original_pyramid))),
+        "states": states,
+        "position": history.position,
+        "current_levels": [],
+        "edits": dict(doc.edits),
+        "blocks": [],
+    }
+    current_block = states[history.position]["block"]
+
+    def write_block(f, array):
+        """write array as .npy at page start, return its block number"""
+        array = np.ascontiguousarray(array)
+        f.write(b"\0" * (-f.tell() % SESSION_ALIGN))
+        np.lib.format.write_array(f, array, allow_pickle=False)
+        header["blocks"].append(
+            {
+                "offset": f.tell() - array.nbytes,
+                "shape": list(array.shape),
+                "dtype": array.dtype.str,
+            }
+        )
+        return len(header["blocks"]) - 1
+
+    def job(task=None):
+        directory = os.path.dirname(path) or "."
+        fd, temp_path = tempfile.mkstemp(
+            prefix=".part-", suffix=".imgsession", dir=directory
+        )
+        try:
+            with TRACER.span("session write"), os.fdopen(fd, "wb") as f:
+                f.write(SESSION_MAGIC)
+                for number, source in enumerate(blocks):
+                    if task is not None:
+                        task.progress(number / len(blocks), "Writing")
+                    array = source()
+                    write_block(f, array)
+                    if number == current_block:
+                        # proxy of current step, reopen show it with no resize
+                        header["current_levels"] = [
+                            write_block(f, level) for level in build_pyramid(array)[1:]
+                        ]
+                index_offset = f.tell()
+                f.write(json.dumps(header).encode("utf-8"))
+                f.write(SESSION_TRAILER.pack(index_offset, SESSION_END))
+                f.flush()
+                os.fsync(f.fileno())
+            replace_file(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return os.path.getsize(path)
+
+    return job
+
+
+def save_session(doc, path, task=None):
+    """write source path, recipes, edits and keyframe pixel of doc"""
+    return session_job(doc, path)(task)
+
+
+def load_session(path):
+    """open session file as document, pixel are memory mapped not read"""
+    name = os.path.basename(path)
+    with open(path, "rb") as f:
+        if f.read(len(SESSION_MAGIC)) != SESSION_MAGIC:
+            raise ValueError(f"not a session file: {name}")
+        size = f.seek(0, os.SEEK_END)
+        f.seek(size - SESSION_TRAILER.size)
+        index_offset, end = SESSION_TRAILER.unpack(f.read(SESSION_TRAILER.size))
+        if end != SESSION_END:
+            raise ValueError(f"session file is not complete: {name}")
+        f.seek(index_offset)
+        header = json.loads(f.read(size - SESSION_TRAILER.size - index_offset))
+
+    def block(number):
+        info = header["blocks"][number]
+        return np.memmap(
+            path,
+            dtype=np.dtype(info["dtype"]),
+            mode="r",
+            offset=info["offset"],
+            shape=tuple(info["shape"]),
+        )
+
+    pyramid = [block(number) for number in header["original"]]
+
+    history = TileHistory(budget_bytes=HISTORY_BUDGET)
+    keyframes = []  # (recipe, pixel) to rebuild steps that have no pixel
+    states = []
+    for entry in header["states"]:
+        state = history.new_state(
+            tuple(entry["shape"]), entry["dtype"], entry["recipe"]
+        )
+        if entry["block"] is not None:
+            state["file"] = path
+            state["offset"] = header["blocks"][entry["block"]]["offset"]
+            state["external"] = True
+            keyframes.append(
+                (entry["recipe"], functools.partial(block, entry["block"]))
+            )
+        else:
+            state["build"] = functools.partial(
+                rebuild_state, pyramid[0], entry["recipe"], keyframes
+            )
+        states.append(state)
+    history.load(states, header["position"])
+
+    doc = ImageDocument(header["source"], pyramid[0], pyramid, history=history)
+    current = header["states"][header["position"]]["block"]
+    if current is not None:
+        levels = [block(number) for number in header["current_levels"]]
+        doc.proxy_pyramid = [block(current)] + levels
+    doc.edits = dict(header["edits"])
+    doc.current_image = history.current()  # current step has a mapped block
+    return doc
+
+
+def rebuild_state(original, recipe, keyframes):
+    """make pixel of step from nearest keyframe whose recipe start the same,
+    or from source, by running the rest of the recipe"""
+    base, done = original, 0
+    for key_recipe, pixels in keyframes:
+        if (
+            key_recipe
+            and len(key_recipe) > done
+            and recipe[: len(key_recipe)] == key_recipe
+        ):
+            base, done = pixels(), len(key_recipe)
+    return run_pipeline(base, recipe[done:])
+
+
+MULTI_FRAME_FORMATS = ("GIF", "TIFF")  # PIL format that can have many frames
+MULTI_FRAME_EXTS = (".gif", ".tif", ".tiff")  # save keep every frame
+FRAME_IN_FLIGHT = 4  # frames decoded, in work or waiting for encoder at once
+
+
+def frame_to_bgr(frame):
+    """PIL frame of any mode to BGR array"""
+    return cv2.cvtColor(np.asarray(frame.convert("RGB")), cv2.COLOR_RGB2BGR)
+
+
+# frames of animated gif or multi page tiff, decoded one by one when asked
+class FrameSource:
+    def __init__(self, path, count, loop=None):
+        self.path = path
+        self.count = count
+        self.loop = loop  # gif repeat count, None when file had none
+
+    @classmethod
+    def probe(cls, path):
+        """FrameSource when file has more than one frame, else None"""
+        try:
+            with Image.open(path) as image:
+                if image.format not in MULTI_FRAME_FORMATS:
+                    return None
+                count = getattr(image, "n_frames", 1)
+                loop = image.info.get("loop")
+        except Exception:
+            return None  # cv2 may still read it
+        return cls(path, count, loop) if count > 1 else None
+
+    def read(self, index):
+        """decode one frame as BGR array"""
+        with Image.open(self.path) as image:
+            image.seek(index)
+            with TRACER.span("decode frame", index=index):
+                return frame_to_bgr(image)
+
+    def frames(self):
+        """give (BGR frame, duration ms) in order, one frame decoded at a time"""
+        with Image.open(self.path) as image:
+            for index in range(self.count):
+                image.seek(index)
+                with TRACER.span("decode frame", index=index):
+                    frame = frame_to_bgr(image)
+                yield frame, image.info.get("duration", 100)
+
+
+def process_frames(frames, steps, pool, in_flight=FRAME_IN_FLIGHT):
+    """run steps on each (frame, duration) on pool, give results in order,
+    at most in_flight frames are alive so memory not grow with frame count"""
+    pending = deque()
+    for frame, duration in frames:
+        pending.append((pool.submit(run_pipeline, frame, steps), duration))
+        if len(pending) >= in_flight:
+            future, duration = pending.popleft()
+            yield future.result(), duration
+    while pending:
+        future, duration = pending.popleft()
+        yield future.result(), duration
+
+
+def write_gif_frames(f, frames, loop=None):
+    """write gif one frame at a time, each frame get its own palette"""
+    count = 0
+    for frame, duration in frames:
+        with TRACER.span("encode frame"):
+            image = Image.fromarray(display_rgb(frame)).quantize(256)
+            if count == 0:
+                info = {"duration": duration}
+                if loop is not None:
+                    info["loop"] = loop
+                header, _ = GifImagePlugin.getheader(image, info=info)
+                f.write(b"".join(header))
+            for data in GifImagePlugin.getdata(
+                image, duration=duration, include_color_table=True
+            ):
+                f.write(data)
+        count += 1
+    f.write(b";")  # gif end
+    return count
+
+
+def write_tiff_frames(f, frames):
+    """write multi page tiff, each page is appended when it is ready"""
+    count = 0
+    with TiffImagePlugin.AppendingTiffWriter(f) as tiff:
+        for frame, _ in frames:
+            with TRACER.span("encode frame"):
+                Image.fromarray(display_rgb(frame)).save(
+                    tiff, format="TIFF", compression="tiff_deflate"
+                )
+            tiff.newFrame()
+            count += 1
+    return count
+
+
+def write_frames_atomic(path, frames, count, loop=None, task=None):
+    """stream frames to gif or tiff file, temp file then rename"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    ext = os.path.splitext(path)[1].lower()
+    fd, temp_path = tempfile.mkstemp(prefix=".part-", suffix=ext, dir=directory)
+
+    def progress(frames):
+        for index, item in enumerate(frames):
+            if task is not None:
+                task.progress(index / count, f"Frame {index + 1}/{count}")
+            yield item
+
+    try:
+        with os.fdopen(fd, "w+b") as f:
+            if ext == ".gif":
+                write_gif_frames(f, progress(frames), loop)
+            else:
+                write_tiff_frames(f, progress(frames))
+            f.flush()
+            os.fsync(f.fileno())
+        replace_file(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return os.path.getsize(path)
+
+
+DOC_CACHE_BYTES = 2 * 1024 * 1024 * 1024  # decoded pixel of all open documents
+DOC_PROXY_SIDE = 2048  # unloaded document keep proxy level not bigger than this
+
+
+# one open image with its edit state, no tk here so bench and batch can use it
+class ImageDocument:
+    def __init__(self, path, image, pyramid=None, history=None):
+        """image is decoded BGR array, pyramid is made here when not given,
+        history is a loaded TileHistory or new one with image as first step"""
+        self.path = path
+        self.original_image = image
+        if pyramid is None:
+            pyramid = build_pyramid(image)
+        self.original_pyramid = pyramid
+        self.serial = next(STATE_IDS)  # display cache key of original
+        self.reduced = 1  # quick preview of bigger file when more than 1
+        self.frames = None  # FrameSource of gif or tiff with many frames
+        self.frame_index = 0  # frame shown and edited now
+        self.current_image = image
+
+        # history base is same picture as original now, share its proxy
+        self.proxy_pyramid = self.original_pyramid
+        self.edits = {}  # slider edit not applied on full size yet, name -> value
+        self.crop_box = None  # crop selection in full size pixel, not applied yet
+
+        # undo redo history, limit by memory not by step count
+        if history is None:
+            history = TileHistory(budget_bytes=HISTORY_BUDGET)
+            history.reset(image, [])  # empty recipe, same as source
+        else:
+            self.current_image = None
+            self.proxy_pyramid = None
+        self.history = history
+
+    @classmethod
+    def open(cls, path, task=None, on_preview=None):
+        """read, decode and make proxy of file, task get progress,
+        on_preview(doc) first get a small document of big jpeg"""
+        frames = FrameSource.probe(path)
+        if frames is not None:
+            # first frame only, others are decoded when shown or saved
+            image = frames.read(0)
+            doc = cls(path, image)
+            doc.frames = frames
+            return doc
+
+        data = read_file_bytes(path, task)
+        factor = reduced_factor(path) if on_preview is not None else 1
+        if factor > 1:
+            if task is not None:
+                task.progress(0.8, "Decoding preview")
+            flags = getattr(cv2, REDUCED_FLAGS[factor])
+            preview = cls(path, decode_image(data, path, flags))
+            preview.reduced = factor
+            on_preview(preview)
+        if task is not None:
+            task.progress(0.85, "Decoding")
+            task.check()
+        image = decode_image(data, path)
+        del data  # file bytes not needed while proxy is made
+        if task is not None:
+            task.progress(0.9, "Making proxy")
+        pyramid = build_pyramid(image)
+        if task is not None:
+            task.check()
+        return cls(path, image, pyramid)
+
+    def close(self):
+        """free history and its scratch file"""
+        self.history.close()
+
+    def loaded(self):
+        """True when full size pixel is in memory"""
+        return self.original_image is not None
+
+    def resident_bytes(self):
+        """bytes of decoded pixel this document hold in memory"""
+        arrays = list(self.original_pyramid) + list(self.proxy_pyramid or [])
+        arrays += [self.current_image, self.history.frame]
+        unique = {
+            id(array): array.nbytes
+            for array in arrays
+            if array is not None and not isinstance(array, np.memmap)
+        }
+        return sum(unique.values()) + self.history.nbytes
+
+    def unload(self, proxy_side=DOC_PROXY_SIDE):
+        """drop full size pixel, keep only proxy for quick show, history go to
+        scratch file, return bytes freed; restore() bring it back"""
+        if not self.loaded():
+            return 0
+        small = [
+            level
+            for level in self.original_pyramid
+            if max(level.shape[:2]) <= proxy_side
+        ]
+        if len(small) == len(self.original_pyramid):
+            return 0  # whole image is proxy size, nothing worth to free
+        before = self.resident_bytes()
+
+        if len(self.history) == 1 and self.history.meta() == []:
+            # only the opened image in history, source file have same pixel
+            self.history.close()
+            self.proxy_pyramid = None
+        else:
+            if self.proxy_pyramid is None:
+                self.proxy_pyramid = build_pyramid(self.history.current())
+            self.proxy_pyramid = [
+                level
+                for level in self.proxy_pyramid
+                if max(level.shape[:2]) <= proxy_side
+            ] or self.proxy_pyramid[-1:]
+            self.history.park()
+
+        self.original_pyramid = small or self.original_pyramid[-1:]
+        if self.proxy_pyramid is None:
+            self.proxy_pyramid = self.original_pyramid
+        self.original_image = None
+        self.current_image = None
+        return before - self.resident_bytes()
+
+    def restore(self, image, pyramid=None):
+        """put decoded source back after unload()"""
+        if pyramid is None:
+            pyramid = build_pyramid(image)
+        self.original_image = image
+        self.original_pyramid = pyramid
+        if len(self.history) == 0:
+            self.history.reset(image, [])
+            self.proxy_pyramid = pyramid
+            self.current_image = image
+        else:
+            self.current_image = self.history.current()
+            self.proxy_pyramid = None  # kept one is only small level
+
+    def proxy(self, width, height, original=False):
+        """small level of image that match this screen size"""
+        if original:
+            pyramid = self.original_pyramid
+        else:
+            if self.proxy_pyramid is None:
+                self.proxy_pyramid = build_pyramid(self.history.current())
+            pyramid = self.proxy_pyramid
+        return pick_level(pyramid, width, height)
+
+    def set_edit(self, name, value):
+        """keep slider value, neutral value remove the edit"""
+        if value == SLIDER_NEUTRAL[name]:
+            self.edits.pop(name, None)
+        else:
+            self.edits[name] = value
+        self.crop_box = None
+
+    def edit_steps(self):
+        """slider edits as recipe steps in fixed order"""
+        return [
+            {"op": name, "value": self.edits[name]}
+            for name in EDIT_ORDER
+            if name in self.edits
+        ]
+
+    def preview_job(self, width, height, pool=None):
+        """function that render edits on the proxy, for render worker"""
+        proxy = self.proxy(width, height)
+        steps = self.edit_steps()
+        scale = proxy.shape[1] / self.history.current().shape[1]
+        for step in steps:
+            if step["op"] in FILTERS:
+                step["scale"] = scale  # filter look same as on full size
+        return lambda: run_pipeline(proxy, steps, pool)
+
+    def render_source(self):
+        """function that make full size image of what is shown now,
+        it can run on other thread while user keep editing"""
+        if self.edits:
+            snapshot = self.history.snapshot()
+            steps = self.edit_steps()
+            return lambda: run_pipeline(snapshot(), steps)
+        if self.crop_box is not None:
+            image, box = self.original_image, self.crop_box
+            return lambda: crop_op(image, box)
+        if self.current_image is self.history.frame:
+            return self.history.snapshot()  # undo can write in that frame
+        image = self.current_image
+        return lambda: image
+
+    def render_full(self):
+        """make the full size image of what is shown right now"""
+        return self.render_source()()
+
+    def recipe(self):
+        """steps from source to current image, None when not known"""
+        return self.history.meta()
+
+    def add_to_history(self, image, recipe=None):
+        """keep image in undo list, recipe is steps from source to image"""
+        with TRACER.span("history push"):
+            self.history.push(image, recipe)
+        self.current_image = image
+        self.proxy_pyramid = None  # base changed, make proxy again when need
+
+    def select_crop(self, box):
+        """remember crop box (x1, y1, x2, y2) in full size pixel"""
+        self.crop_box = box
+        self.edits = {}
+
+    def crop_valid(self):
+        x1, y1, x2, y2 = self.crop_box or (0, 0, 0, 0)
+        return x2 > x1 and y2 > y1
+
+    def apply_crop(self):
+        """cut crop from original, return False when no valid crop"""
+        if not self.crop_valid():
+            return False
+        # only place full size pixel of crop is copied
+        self.add_to_history(
+            crop_op(self.original_image, self.crop_box).copy(),
+            [{"op": "crop", "value": [int(v) for v in self.crop_box]}],
+        )
+        self.crop_box = None
+        return True
+
+    def reset_crop(self):
+        """forget crop selection, show original again"""
+        self.crop_box = None
+        self.current_image = self.original_image
+
+    def apply_edits(self):
+        """run slider edits on full size image, return False when no edit"""
+        if not self.edits:
+            return False
+        recipe = self.recipe()
+        if recipe is not None:
+            recipe = recipe + self.edit_steps()
+        self.add_to_history(self.render_full(), recipe)
+        self.edits = {}
+        return True
+
+    def move_history(self, step):
+        """undo (-1) or redo (1), return False when nothing there"""
+        moved = self.history.undo() if step < 0 else self.history.redo()
+        if moved:
+            self.current_image = self.history.current()
+            self.proxy_pyramid = None
+            self.edits = {}
+            self.crop_box = None
+        return moved
+
+    def undo(self):
+        return self.move_history(-1)
+
+    def redo(self):
+        return self.move_history(1)
+
+    def frame_job(self, index):
+        """function(task) that decode frame and run recipe on it, for io thread"""
+        frames, recipe = self.frames, self.recipe() or []
+
+        def job(task=None):
+            image = frames.read(index)
+            edited = run_pipeline(image, recipe) if recipe else None
+            return index, image, edited, recipe
+
+        return job
+
+    def set_frame(self, index, image, edited, recipe):
+        """show other frame, recipe of history is run on it so edits stay,
+        undo steps of old frame are dropped"""
+        self.frame_index = index
+        self.original_image = image
+        self.original_pyramid = build_pyramid(image)
+        self.serial = next(STATE_IDS)
+        self.history.reset(image, [])
+        self.current_image = image
+        self.proxy_pyramid = self.original_pyramid
+        if edited is not None:
+            self.add_to_history(edited, recipe)
+        self.crop_box = None
+
+    def save_job(self, path, preset=None):
+        """function(task) that write what is shown now, for io thread, it
+        return export report dict of the file"""
+        if self.frames is not None and path.lower().endswith(MULTI_FRAME_EXTS):
+            return self.save_frames_job(path)
+        source = self.render_source()  # full size pass only when job run
+        params = encode_params(path, preset)
+
+        def job(task=None):
+            if task is not None:
+                task.progress(0.0, "Rendering")
+            return export_one(path, source(), params, task, write_progress=True)
+
+        return job
+
+    def export_job(self, targets, preset=None, workers=None):
+        """function(task) that write shown image to every (path, percent)
+        target at once, return list of report dict"""
+        source = self.render_source()
+
+        def job(task=None):
+            if task is not None:
+                task.progress(0.0, "Rendering")
+            return export_image(source(), targets, preset, workers, task)
+
+        return job
+
+    def save_frames_job(self, path, workers=None):
+        """function(task) that run recipe and slider edits on every frame and
+        stream them to the file"""
+        frames = self.frames
+        recipe = self.recipe()
+        if recipe is None:
+            raise ValueError("history has step with no recipe, cannot edit frames")
+        steps = recipe + self.edit_steps()
+
+        def job(task=None):
+            workers_count = workers or os.cpu_count() or 1
+            start = time.perf_counter()
+            with ThreadPoolExecutor(
+                max_workers=workers_count, thread_name_prefix="frame"
+            ) as pool:
+                edited = process_frames(
+                    frames.frames(), steps, pool, max(FRAME_IN_FLIGHT, workers_count)
+                )
+                size = write_frames_atomic(
+                    path, edited, frames.count, frames.loop, task
+                )
+            # frames are edited and encoded together, time is of the whole
+            return {
+                "path": path,
+                "frames": frames.count,
+                "bytes": size,
+                "encode_ms": (time.perf_counter() - start) * 1000,
+                "write_ms": 0.0,
+            }
+
+        return job
+
+    def save(self, path, task=None, preset=None):
+        """write what is shown now to path, return file size"""
+        return self.save_job(path, preset)(task)["bytes"]
+
+
+# open documents, decoded pixel of least recently used one is dropped first
+class DocumentCache:
+    def __init__(self, budget_bytes=DOC_CACHE_BYTES):
+        self.budget_bytes = budget_bytes
+        self.docs = OrderedDict()  # loaded document -> None, last is newest
+
+    def nbytes(self):
+        return sum(doc.resident_bytes() for doc in self.docs)
+
+    def touch(self, doc):
+        """doc is used now, unload old documents if over budget,
+        return documents that was unloaded"""
+        if doc.loaded():
+            self.docs[doc] = None
+            self.docs.move_to_end(doc)
+        return self.trim(keep=doc)
+
+    def discard(self, doc):
+        self.docs.pop(doc, None)
+
+    def trim(self, keep=None):
+        """unload least recently used documents until inside budget"""
+        unloaded = []
+        total = self.nbytes()
+        for doc in list(self.docs):
+            if total <= self.budget_bytes:
+                break
+            if doc is keep:
+                continue
+            total -= doc.unload()
+            del self.docs[doc]
+            unloaded.append(doc)
+        return unloaded
+
+
+DISPLAY_CACHE_SIZE = 16  # ready screen frames kept for each canvas
+
+
+# one photo and one canvas item for a canvas, reused on every show
+class CanvasDisplay:
+    def __init__(self, canvas, size=DISPLAY_CACHE_SIZE):
+        self.canvas = canvas
+        self.size = size
+        self.frames = OrderedDict()  # (version, canvas size) -> PIL image
+        self.photo = None
+        self.item = None
+
+    def lookup(self, version, canvas_size):
+        """ready frame for this image version and canvas size, or None"""
+        if version is None:
+            return None
+        frame = self.frames.get((version, canvas_size))
+        if frame is not None:
+            self.frames.move_to_end((version, canvas_size))
+        return frame
+
+    def make_frame(self, image, version, canvas_size):
+        """resize image to fit canvas, keep it when it has a version"""
+        canvas_width, canvas_height = canvas_size
+        img_height, img_width = image.shape[:2]
+        scaling = min(canvas_width / img_width, canvas_height / img_height)
+        new_width = max(1, int(img_width * scaling))
+        new_height = max(1, int(img_height * scaling))
+
+        with TRACER.span("display resize"):
+            small = cv2.resize(image, (new_width, new_height))
+        small = display_rgb(small)
+        with TRACER.span("fromarray"):
+            frame = Image.fromarray(small)
+        if version is not None:
+            self.frames[(version, canvas_size)] = frame
+            while len(self.frames) > self.size:
+                self.frames.popitem(last=False)
+        return frame
+
+    def put(self, frame):
+        """paste frame in old photo, new photo only when size change"""
+        width, height = frame.size
+        if (
+            self.photo is None
+            or self.photo.width() != width
+            or self.photo.height() != height
+        ):
+            with TRACER.span("PhotoImage"):
+                self.photo = ImageTk.PhotoImage(image=frame)
+            if self.item is not None:
+                self.canvas.itemconfig(self.item, image=self.photo)
+        else:
+            with TRACER.span("PhotoImage paste"):
+                self.photo.paste(frame)
+
+        self.canvas.config(width=width, height=height)
+        if self.item is None:
+            self.item = self.canvas.create_image(
+                width // 2, height // 2, image=self.photo, anchor=tk.CENTER
+            )
+            self.canvas.tag_lower(self.item)  # crop box stay on top
+        else:
+            self.canvas.coords(self.item, width // 2, height // 2)
+
+    def hide(self):
+        """remove canvas item, zoom mode draw its own tiles"""
+        if self.item is not None:
+            self.canvas.delete(self.item)
+            self.item = None
+
+
+THUMB_SIZE = 96  # longest side of thumbnail in pixel
+THUMB_ROW = THUMB_SIZE + 8  # height of one row in folder panel
+THUMB_DIR = os.path.join(os.path.expanduser("~"), ".cache", "imgapp", "thumbs")
+THUMB_MEMORY = 1024  # thumbnails kept ready for scroll back
+THUMB_QUALITY = 85  # jpeg quality of cached thumbnail file
+
+
+def make_thumbnail(path, size=THUMB_SIZE):
+    """small BGR image of file, jpeg is decoded at reduced size"""
+    factor = reduced_factor(path, min_side=size)
+    image = decode_image(
+        read_file_bytes(path),
+        path,
+        getattr(cv2, REDUCED_FLAGS[factor]) if factor > 1 else None,
+    )
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    if scale < 1:
+        image = cv2.resize(
+            image,
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA,
+        )
+    return image
+
+
+# thumbnail files on disk, changed source get new key so no stale thumbnail
+class ThumbnailCache:
+    def __init__(self, folder=THUMB_DIR, size=THUMB_SIZE):
+        self.folder = folder
+        self.size = size
+
+    def cache_path(self, path):
+        """cache file name from path, mtime and size of source"""
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{self.size}"
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, name[:2], name + ".jpg")
+
+    def load(self, path):
+        """thumbnail from cache file, or make it and keep it there"""
+        cached = self.cache_path(path)
+        image = cv2.imread(cached) if os.path.exists(cached) else None
+        if image is None:
+            image = make_thumbnail(path, self.size)
+            try:
+                write_image_atomic(
+                    cached, image, [cv2.IMWRITE_JPEG_QUALITY, THUMB_QUALITY]
+                )
+            except OSError:
+                pass  # cache folder not writable, thumbnail still work
+        return image
+
+
+# make thumbnails on worker threads, result come back on gui thread
+class ThumbnailLoader:
+    def __init__(self, post, cache, workers=None):
+        self.post = post
+        self.cache = cache
+        self.pool = ThreadPoolExecutor(
+            max_workers=workers or min(8, os.cpu_count() or 1),
+            thread_name_prefix="thumbnail",
+        )
+        self.pending = {}  # path -> future, only used on gui thread
+
+    def request(self, path, on_done):
+        """make thumbnail of path, on_done(path, image or None) on gui thread"""
+        if path in self.pending:
+            return
+        future = self.pool.submit(self.cache.load, path)
+        self.pending[path] = future
+        future.add_done_callback(functools.partial(self.finish, path, on_done))
+
+    def finish(self, path, on_done, future):
+        """worker thread, pass result to gui thread"""
+        self.post(functools.partial(self.deliver, path, on_done, future))
+
+    def deliver(self, path, on_done, future):
+        if self.pending.get(path) is future:
+            del self.pending[path]
+        if future.cancelled():
+            return
+        try:
+            image = future.result()
+        except Exception:
+            image = None  # broken file, row show no picture
+        on_done(path, image)
+
+    def keep_only(self, paths):
+        """cancel waiting request of row that is scrolled away"""
+        for path, future in list(self.pending.items()):
+            if path not in paths and future.cancel():
+                del self.pending[path]
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# filmstrip of a folder, only rows on screen have canvas items
+class FolderPanel:
+    def __init__(self, parent, loader, on_open, width=THUMB_SIZE + 180):
+        self.loader = loader
+        self.on_open = on_open  # on_open(path) when row is clicked
+        self.frame = ttk.LabelFrame(parent, text="Folder")
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas = tk.Canvas(
+            self.frame,
+            width=width,
+            bg="white",
+            highlightthickness=0,
+            yscrollincrement=THUMB_ROW,
+            yscrollcommand=self.on_scroll,
+        )
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.config(command=self.canvas.yview)
+
+        self.paths = []
+        self.slots = []  # reused row items, count follow panel height only
+        self.thumbs = OrderedDict()  # path -> PIL thumbnail, lru
+        self.selected = None
+        self.highlight = self.canvas.create_rectangle(
+            0, 0, 0, 0, fill="lightblue", outline="", state=tk.HIDDEN
+        )
+
+        self.canvas.bind("<Configure>", lambda event: self.layout())
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<MouseWheel>", self.on_wheel)
+        self.canvas.bind("<Button-4>", self.on_wheel)
+        self.canvas.bind("<Button-5>", self.on_wheel)
+
+    def show_folder(self, folder):
+        """list image files of folder, thumbnails come later"""
+        with os.scandir(folder) as entries:
+            self.paths = sorted(
+                entry.path
+                for entry in entries
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTS)
+            )
+        self.frame.config(
+            text=f"{os.path.basename(folder) or folder} ({len(self.paths)} images)"
+        )
+        self.selected = None
+        self.canvas.itemconfig(self.highlight, state=tk.HIDDEN)
+        self.canvas.config(scrollregion=(0, 0, 1, len(self.paths) * THUMB_ROW))
+        for slot in self.slots:
+            slot["row"] = None
+        self.canvas.yview_moveto(0)
+        self.layout()
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.layout()
+
+    def on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.canvas.yview_scroll(-3, "units")
+        else:
+            self.canvas.yview_scroll(3, "units")
+
+    def visible_rows(self):
+        top = max(0, int(self.canvas.canvasy(0)) // THUMB_ROW)
+        count = self.canvas.winfo_height() // THUMB_ROW + 2
+        return range(top, min(top + count, len(self.paths)))
+
+    def layout(self):
+        """give row items to rows on screen, ask thumbnails of them"""
+        rows = self.visible_rows()
+        while len(self.slots) < len(rows):
+            self.slots.append(
+                {
+                    "image": self.canvas.create_image(0, 0, state=tk.HIDDEN),
+                    "text": self.canvas.create_text(0, 0, anchor=tk.W, state=tk.HIDDEN),
+                    "photo": None,
+                    "row": None,
+                }
+            )
+        self.loader.keep_only({self.paths[row] for row in rows})
+
+        free = [slot for slot in self.slots if slot["row"] not in rows]
+        used = {slot["row"] for slot in self.slots if slot["row"] in rows}
+        for row in rows:
+            if row not in used:
+                self.fill(free.pop(), row)
+        for slot in free:
+            slot["row"] = None
+            slot["photo"] = None
+            self.canvas.itemconfig(slot["image"], state=tk.HIDDEN)
+            self.canvas.itemconfig(slot["text"], state=tk.HIDDEN)
+
+    def fill(self, slot, row):
+        """show row in slot, thumbnail from memory or ask worker"""
+        path = self.paths[row]
+        y = row * THUMB_ROW + THUMB_ROW // 2
+        slot["row"] = row
+        self.canvas.coords(slot["text"], THUMB_SIZE + 12, y)
+        self.canvas.itemconfig(
+            slot["text"], text=os.path.basename(path), state=tk.NORMAL
+        )
+        self.canvas.coords(slot["image"], 4 + THUMB_SIZE // 2, y)
+        thumb = self.thumbs.get(path)
+        if thumb is None:
+            self.canvas.itemconfig(slot["image"], state=tk.HIDDEN)
+            self.loader.request(path, self.thumb_ready)
+        else:
+            self.thumbs.move_to_end(path)
+            self.set_thumb(slot, thumb)
+
+    def set_thumb(self, slot, thumb):
+        slot["photo"] = ImageTk.PhotoImage(image=thumb)
+        self.canvas.itemconfig(slot["image"], image=slot["photo"], state=tk.NORMAL)
+
+    def thumb_ready(self, path, image):
+        """worker finished thumbnail, show it if row is still on screen"""
+        if image is None:
+            return
+        thumb = Image.fromarray(display_rgb(image))
+        self.thumbs[path] = thumb
+        while len(self.thumbs) > THUMB_MEMORY:
+            self.thumbs.popitem(last=False)
+        for slot in self.slots:
+            row = slot["row"]
+            if row is not None and row < len(self.paths) and self.paths[row] == path:
+                self.set_thumb(slot, thumb)
+
+    def on_click(self, event):
+        row = int(self.canvas.canvasy(event.y)) // THUMB_ROW
+        if 0 <= row < len(self.paths):
+            self.selected = row
+            self.canvas.coords(
+                self.highlight, 0, row * THUMB_ROW, 10000, (row + 1) * THUMB_ROW
+            )
+            self.canvas.itemconfig(self.highlight, state=tk.NORMAL)
+            self.canvas.tag_lower(self.highlight)
+            self.on_open(self.paths[row])
+
+
+# choose formats, sizes and preset, then ask file name for export
+class ExportDialog:
+    def __init__(self, root, preset_var, on_export):
+        self.on_export = on_export
+        self.window = tk.Toplevel(root)
+        self.window.title("Export")
+        self.window.transient(root)
+        self.window.resizable(False, False)
+        frame = ttk.Frame(self.window, padding=10)
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        ttk.Label(frame, text="Preset:").grid(row=0, column=0, sticky=tk.W)
+        ttk.Combobox(
+            frame,
+            textvariable=preset_var,
+            values=list(EXPORT_PRESETS),
+            state="readonly",
+            width=14,
+        ).grid(row=0, column=1, columnspan=3, sticky=tk.W, pady=2)
+
+        ttk.Label(frame, text="Formats:").grid(row=1, column=0, sticky=tk.W)
+        self.format_vars = {}
+        for column, fmt in enumerate(EXPORT_FORMATS, 1):
+            var = tk.BooleanVar(value=fmt == "png")
+            ttk.Checkbutton(frame, text=fmt.upper(), variable=var).grid(
+                row=1, column=column, sticky=tk.W
+            )
+            self.format_vars[fmt] = var
+
+        ttk.Label(frame, text="Sizes (%):").grid(row=2, column=0, sticky=tk.W)
+        self.sizes_var = tk.StringVar(value="100")
+        ttk.Entry(frame, textvariable=self.sizes_var, width=16).grid(
+            row=2, column=1, columnspan=3, sticky=tk.W, pady=2
+        )
+
+        self.error_var = tk.StringVar(value="")
+        ttk.Label(frame, textvariable=self.error_var, foreground="red").grid(
+            row=3, column=0, columnspan=4, sticky=tk.W
+        )
+        buttons = ttk.Frame(frame)
+        buttons.grid(row=4, column=0, columnspan=4, sticky=tk.E, pady=(6, 0))
+        ttk.Button(buttons, text="Export...", command=self.export).pack(side=tk.LEFT)
+        ttk.Button(buttons, text="Close", command=self.window.destroy).pack(
+            side=tk.LEFT, padx=(5, 0)
+        )
+
+    def exists(self):
+        return bool(self.window.winfo_exists())
+
+    def lift(self):
+        self.window.lift()
+
+    def sizes(self):
+        """percent list from entry like "100, 50, 25", error is ValueError"""
+        sizes = []
+        for part in self.sizes_var.get().replace(",", " ").split():
+            percent = int(part)
+            if not 1 <= percent <= 400:
+                raise ValueError(f"size {percent}% must be 1 to 400")
+            if percent not in sizes:
+                sizes.append(percent)
+        if not sizes:
+            raise ValueError("give at least one size")
+        return sizes
+
+    def export(self):
+        formats = [fmt for fmt, var in self.format_vars.items() if var.get()]
+        if not formats:
+            self.error_var.set("Choose at least one format")
+            return
+        try:
+            sizes = self.sizes()
+        except ValueError as e:
+            self.error_var.set(f"Bad sizes: {e}")
+            return
+        self.error_var.set("")
+        base_path = filedialog.asksaveasfilename(
+            parent=self.window,
+            title="Export base name, format and size are added",
+            initialfile="export",
+        )
+        if base_path:
+            self.on_export(base_path, formats, sizes)
+
+
+# startup timing mode, time from program start to window and first image
+class StartupTimer:
+    def __init__(self, start=STARTUP_START):
+        self.start = start
+        self.marks = {}  # name -> seconds from start, first time only
+
+    def mark(self, name):
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter() - self.start
+
+    def report(self):
+        return ", ".join(
+            f"{name}: {seconds * 1000:.0f} ms" for name, seconds in self.marks.items()
+        )
+
+
+CROP_PREVIEW_MS = 16  # crop preview at most once a screen frame, 60 fps
 
 
 # main class for app
 class ImageProcessingApp:
-    def __init__(self, root):
-        """Start app window and set variable"""
+    def __init__(self, root, startup=None, open_path=None):
+        """Start app window and set variable, startup is StartupTimer in
+        timing mode, open_path is image opened when window is up"""
         self.root = root
         self.root.title("Image Processing Application")  # name on top bar
         self.root.geometry("1200x700")  # window size
 
-        # image hold here
-        self.original_image = None
-        self.displayed_image = None
-        self.cropped_image = None
-        self.current_image = None
-        self.temp_image = None
+        # open images, each with its own edit state and history
+        self.doc = None  # shown document, None before first load
+        self.docs = []  # open documents in menu order
+        self.doc_cache = DocumentCache(DOC_CACHE_BYTES)
+        self.doc_choice = tk.IntVar(value=-1)  # index of shown one, for menu
 
         # crop mouse drag variable
         self.start_x = None
@@ -27,18 +2628,98 @@ class ImageProcessingApp:
         self.end_y = None
         self.crop_rectangle = None
         self.is_drawing = False
+        self.crop_preview_waiting = False  # preview is already asked for next frame
+        self.syncing_sliders = False  # slider moved by code, not by user
+
+        # preview output buffer reused by render worker
+        self.preview_pool = BufferPool()
+
+        # zoom and pan mode for big image
+        self.zoom_mode = tk.BooleanVar(value=False)
+        self.view_cache = TileCache(VIEW_CACHE_BYTES)
 
-        # undo redo history
-        self.history = []
-        self.history_position = -1
-        self.max_history = 10  # max how many undo
+        # function from other thread wait here for gui thread
+        self.ui_queue = queue.Queue()
+        self.render_worker = RenderWorker(self.post_to_ui)
 
-        # file path for save
-        self.current_file_path = None
+        # last frame stage timing in status bar
+        self.timing_overlay = tk.BooleanVar(value=False)
+        self.trace_recording = tk.BooleanVar(value=False)  # keep event for export
+        self.timing_frame = -1  # tracer frame count shown in overlay
+
+        # folder panel thumbnails made on worker threads
+        self.thumb_loader = ThumbnailLoader(self.post_to_ui, ThumbnailCache())
+
+        # encoder settings used by save and export
+        self.export_preset = tk.StringVar(value=EXPORT_DEFAULT)
+        self.export_dialog = None
+
+        # load and save run on io thread, only one file job at a time
+        self.io_service = IOService(self.post_to_ui)
+        self.io_task = None
+        self.io_kind = None  # "load" or "save" while job is running
 
         # setup GUI
         self.setup_menu()  # top menu
         self.setup_ui()  # buttons and canvas
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.pump_ui()
+
+        # numpy, cv2 and PIL load while user look at the window
+        self.startup = startup
+        self.open_path = open_path
+        self.root.bind("<Map>", self.on_map, add="+")
+        warm_modules(
+            lambda seconds: self.post_to_ui(
+                functools.partial(self.startup_mark, "modules warm")
+            )
+        )
+        if open_path:
+            self.root.after_idle(functools.partial(self.open_file, open_path))
+
+    def on_map(self, event):
+        """window is on screen first time"""
+        if event.widget is self.root:
+            self.startup_mark("first window")
+
+    def startup_mark(self, name):
+        """keep startup time, in timing mode print it and quit when done"""
+        if self.startup is None:
+            return
+        self.startup.mark(name)
+        wanted = {"first window", "modules warm"}
+        if self.open_path:
+            wanted.update(("first image", "full image"))
+        if wanted <= set(self.startup.marks):
+            print(f"startup: {self.startup.report()}")
+            self.on_close()
+
+    def on_close(self):
+        """remove scratch file then close window"""
+        if self.io_kind == "load":
+            self.io_task.cancel()
+        self.thumb_loader.close()
+        self.io_service.pool.shutdown(wait=True)  # let save finish its rename
+        for doc in set(self.docs + [self.doc]) - {None}:
+            doc.close()
+        self.root.quit()
+
+    def post_to_ui(self, func):
+        """call func later on gui thread, safe from any thread"""
+        self.ui_queue.put(func)
+
+    def pump_ui(self):
+        """run waiting gui function, tk is not safe from other thread"""
+        while True:
+            try:
+                func = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            func()
+        if self.timing_overlay.get() and TRACER.frames != self.timing_frame:
+            self.timing_frame = TRACER.frames
+            self.timing_var.set(TRACER.frame_summary())
+        self.root.after(15, self.pump_ui)
 
     def setup_menu(self):
         """top menu bar"""
@@ -51,24 +2732,93 @@ class ImageProcessingApp:
         file_menu.add_command(
             label="Open", command=self.load_image, accelerator="Ctrl+O"
         )
+        file_menu.add_command(
+            label="Open Folder...", command=self.open_folder, accelerator="Ctrl+Shift+O"
+        )
         file_menu.add_command(
             label="Save", command=self.save_image, accelerator="Ctrl+S"
         )
         file_menu.add_command(label="Save As", command=self.save_image_as)
+        file_menu.add_command(label="Export...", command=self.show_export)
+        preset_menu = Menu(file_menu, tearoff=0)
+        file_menu.add_cascade(label="Export Preset", menu=preset_menu)
+        for name in EXPORT_PRESETS:
+            preset_menu.add_radiobutton(
+                label=name, value=name, variable=self.export_preset
+            )
         file_menu.add_separator()
-        file_menu.add_command(label="Exit", command=self.root.quit)
+        file_menu.add_command(label="Open Session...", command=self.open_session)
+        file_menu.add_command(label="Save Session...", command=self.save_session)
+        file_menu.add_checkbutton(
+            label="Record Trace",
+            variable=self.trace_recording,
+            command=self.toggle_timing,
+        )
+        file_menu.add_command(label="Export Trace...", command=self.export_trace)
+        file_menu.add_separator()
+        file_menu.add_command(label="Exit", command=self.on_close)
 
         # edit menu (undo redo)
         edit_menu = Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Edit", menu=edit_menu)
         edit_menu.add_command(label="Undo", command=self.undo, accelerator="Ctrl+Z")
         edit_menu.add_command(label="Redo", command=self.redo, accelerator="Ctrl+Y")
+        edit_menu.add_separator()
+        edit_menu.add_command(
+            label="Measure Filter Speedup", command=self.measure_filter_speedup
+        )
+
+        # document menu, list of open image is added by refresh_documents_menu
+        self.documents_menu = Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="Documents", menu=self.documents_menu)
+        self.documents_menu.add_command(
+            label="Next Document",
+            command=lambda: self.cycle_document(1),
+            accelerator="Ctrl+Tab",
+        )
+        self.documents_menu.add_command(
+            label="Previous Document",
+            command=lambda: self.cycle_document(-1),
+            accelerator="Ctrl+Shift+Tab",
+        )
+        self.documents_menu.add_command(
+            label="Close Document", command=self.close_document, accelerator="Ctrl+W"
+        )
+        self.documents_menu.add_separator()
+        self.documents_menu_fixed = self.documents_menu.index(tk.END) + 1
+
+        # view menu
+        view_menu = Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="View", menu=view_menu)
+        view_menu.add_command(
+            label="Next Frame", command=lambda: self.step_frame(1), accelerator="PgDn"
+        )
+        view_menu.add_command(
+            label="Previous Frame",
+            command=lambda: self.step_frame(-1),
+            accelerator="PgUp",
+        )
+        view_menu.add_checkbutton(
+            label="Zoom/Pan Mode", variable=self.zoom_mode, command=self.toggle_zoom
+        )
+        view_menu.add_checkbutton(
+            label="Timing Overlay",
+            variable=self.timing_overlay,
+            command=self.toggle_timing,
+        )
 
         # keyboard shortcut
         self.root.bind("<Control-o>", lambda event: self.load_image())
+        self.root.bind("<Control-O>", lambda event: self.open_folder())
         self.root.bind("<Control-s>", lambda event: self.save_image())
         self.root.bind("<Control-z>", lambda event: self.undo())
         self.root.bind("<Control-y>", lambda event: self.redo())
+        self.root.bind("<Escape>", lambda event: self.cancel_io())
+        self.root.bind("<Control-w>", lambda event: self.close_document())
+        self.root.bind("<Next>", lambda event: self.step_frame(1))
+        self.root.bind("<Prior>", lambda event: self.step_frame(-1))
+        self.root.bind("<Control-Tab>", lambda event: self.cycle_document(1))
+        self.root.bind("<Control-Shift-Tab>", lambda event: self.cycle_document(-1))
 
     def setup_ui(self):
         """Make layout on window"""
@@ -98,6 +2848,31 @@ class ImageProcessingApp:
         )
         self.processed_canvas.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
+        # screen frame cache for fit view
+        self.displays = {
+            self.original_canvas: CanvasDisplay(self.original_canvas),
+            self.processed_canvas: CanvasDisplay(self.processed_canvas),
+        }
+
+        # zoom mode: wheel zoom, right button drag to move
+        self.viewers = {}
+        for name, canvas in (
+            ("original", self.original_canvas),
+            ("processed", self.processed_canvas),
+        ):
+            viewer = TileViewer(canvas, self.view_cache, name)
+            self.viewers[canvas] = viewer
+            canvas.bind("<MouseWheel>", functools.partial(self.on_wheel, viewer))
+            canvas.bind("<Button-4>", functools.partial(self.on_wheel, viewer))
+            canvas.bind("<Button-5>", functools.partial(self.on_wheel, viewer))
+            canvas.bind("<ButtonPress-3>", functools.partial(self.start_pan, viewer))
+            canvas.bind("<B3-Motion>", functools.partial(self.on_pan, viewer))
+
+        # folder filmstrip, shown on right when a folder is opened
+        self.folder_panel = FolderPanel(
+            main_frame, self.thumb_loader, self.open_from_panel
+        )
+
         # bottom part controls
         self.controls_frame = ttk.LabelFrame(main_frame, text="Controls")
         self.controls_frame.grid(
@@ -128,6 +2903,19 @@ class ImageProcessingApp:
         )
         self.apply_crop_btn.grid(row=0, column=3, padx=5, pady=5)
 
+        # apply slider edit on full size image
+        self.apply_edit_btn = ttk.Button(
+            self.controls_frame, text="Apply Edit", command=self.apply_edit
+        )
+        self.apply_edit_btn.grid(row=0, column=4, padx=5, pady=5)
+
+        # stop load or save
+        self.cancel_btn = ttk.Button(
+            self.controls_frame, text="Cancel", command=self.cancel_io
+        )
+        self.cancel_btn.grid(row=0, column=5, padx=5, pady=5)
+        self.cancel_btn.state(["disabled"])
+
         # resize slider
         ttk.Label(self.controls_frame, text="Resize:").grid(
             row=1, column=0, padx=5, pady=5
@@ -162,89 +2950,544 @@ class ImageProcessingApp:
             row=2, column=1, columnspan=3, padx=5, pady=5, sticky="ew"
         )
 
-        # status bar bottom
-        self.status_var = tk.StringVar()
-        self.status_var.set("Ready")
-        self.status_bar = ttk.Label(
-            self.root, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W
-        )
-        self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        # contrast slider
+        ttk.Label(self.controls_frame, text="Contrast:").grid(
+            row=3, column=0, padx=5, pady=5
+        )
+        self.contrast_slider = ttk.Scale(
+            self.controls_frame,
+            from_=-100,
+            to=100,
+            orient="horizontal",
+            length=300,
+            value=0,
+            command=self.adjust_contrast,
+        )
+        self.contrast_slider.grid(
+            row=3, column=1, columnspan=3, padx=5, pady=5, sticky="ew"
+        )
+
+        # gamma slider
+        ttk.Label(self.controls_frame, text="Gamma:").grid(
+            row=4, column=0, padx=5, pady=5
+        )
+        self.gamma_slider = ttk.Scale(
+            self.controls_frame,
+            from_=0.2,
+            to=3.0,
+            orient="horizontal",
+            length=300,
+            value=1.0,
+            command=self.adjust_gamma,
+        )
+        self.gamma_slider.grid(
+            row=4, column=1, columnspan=3, padx=5, pady=5, sticky="ew"
+        )
+
+        # filter sliders, right of the others
+        self.filter_sliders = {}
+        for row, (name, label, low, high) in enumerate(
+            (
+                ("denoise", "Denoise:", 0, 100),
+                ("blur", "Blur:", 0, 20),
+                ("sharpen", "Sharpen:", 0, 300),
+                ("local_contrast", "Local Contrast:", 0, 100),
+            ),
+            start=1,
+        ):
+            ttk.Label(self.controls_frame, text=label).grid(
+                row=row, column=4, padx=5, pady=5
+            )
+            slider = ttk.Scale(
+                self.controls_frame,
+                from_=low,
+                to=high,
+                orient="horizontal",
+                length=200,
+                value=SLIDER_NEUTRAL[name],
+                command=functools.partial(self.adjust_filter, name),
+            )
+            slider.grid(row=row, column=5, columnspan=2, padx=5, pady=5, sticky="ew")
+            self.filter_sliders[name] = slider
+
+        # status bar bottom
+        self.status_var = tk.StringVar()
+        self.status_var.set("Ready")
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        self.status_bar = ttk.Label(
+            status_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W
+        )
+        self.status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+        # stage timing of last frame, only packed when overlay is on
+        self.timing_var = tk.StringVar()
+        self.timing_bar = ttk.Label(
+            status_frame, textvariable=self.timing_var, relief=tk.SUNKEN, anchor=tk.E
+        )
+
+        # make window resize friendly
+        main_frame.columnconfigure(0, weight=1)
+        main_frame.columnconfigure(1, weight=1)
+        main_frame.rowconfigure(0, weight=1)
+        main_frame.rowconfigure(1, weight=0)
+
+    def load_image(self):
+        """open file and show image"""
+        if self.io_task is not None:
+            self.status_var.set("Wait, file is still loading or saving")
+            return
+
+        file_path = filedialog.askopenfilename(
+            filetypes=[
+                ("Image files", "*.jpg *.jpeg *.png *.bmp *.gif *.tif *.tiff"),
+                ("All files", "*.*"),
+            ]
+        )
+
+        if file_path:
+            self.open_file(file_path)
+
+    def open_folder(self):
+        """list folder in filmstrip panel"""
+        folder = filedialog.askdirectory()
+        if not folder:
+            return
+        try:
+            self.folder_panel.show_folder(folder)
+        except OSError as e:
+            self.status_var.set(f"Error reading folder: {str(e)}")
+            return
+        self.folder_panel.frame.grid(
+            row=0, column=2, rowspan=2, padx=5, pady=5, sticky="ns"
+        )
+        self.status_var.set(f"Folder: {folder}")
+
+    def open_from_panel(self, file_path):
+        """row clicked in folder panel, switch if file is already open"""
+        for doc in self.docs:
+            if doc.path == file_path:
+                self.switch_document(doc)
+                return
+        if self.io_task is not None:
+            self.status_var.set("Wait, file is still loading or saving")
+            return
+        self.open_file(file_path)
+
+    def open_file(self, file_path):
+        """read and decode file on io thread"""
+
+        def job(task):
+            preview = functools.partial(self.post_preview, task)
+            return ImageDocument.open(file_path, task, on_preview=preview)
+
+        def done(doc):
+            # full image replace the preview, crop framed on preview stay
+            self.install_document(doc, keep_crop=self.showing_preview())
+
+        def failed(error):
+            if self.showing_preview():
+                self.drop_document()  # no full image will come for preview
+            if isinstance(error, IOCancelled):
+                self.status_var.set("Loading cancelled")
+            else:
+                self.status_var.set(f"Error loading image: {str(error)}")
+
+        self.start_io("load", job, done, failed, os.path.basename(file_path))
+
+    def post_preview(self, task, doc):
+        """io thread give quick preview, show it on gui thread"""
+
+        def show():
+            if task is not self.io_task:
+                doc.close()  # load already finished or was cancelled
+                return
+            self.install_document(doc)
+            self.status_var.set(
+                f"Preview 1/{doc.reduced} size of {os.path.basename(doc.path)}, "
+                "loading full image..."
+            )
+
+        self.post_to_ui(show)
+
+    def showing_preview(self):
+        """True when shown image is quick preview of a loading file"""
+        return self.doc is not None and self.doc.reduced > 1
+
+    def drop_document(self):
+        """close shown image, show next open document or clear both canvas"""
+        doc = self.doc
+        index = len(self.docs)
+        if doc in self.docs:
+            index = self.docs.index(doc)
+            self.docs.remove(doc)
+            self.doc_cache.discard(doc)
+        self.doc = None
+        if doc is not None:
+            doc.close()
+        if self.docs:
+            self.activate(self.docs[min(index, len(self.docs) - 1)])
+            return
+
+        self.render_worker.cancel()
+        if self.crop_rectangle:
+            self.original_canvas.delete(self.crop_rectangle)
+            self.crop_rectangle = None
+        for canvas in (self.original_canvas, self.processed_canvas):
+            self.displays[canvas].hide()
+            self.viewers[canvas].reset()
+        self.reset_sliders()
+        self.refresh_documents_menu()
+
+    def install_document(self, doc, keep_crop=False):
+        """new image is decoded, add it to open documents and show,
+        keep_crop keep crop framed on the preview of same file"""
+        if self.showing_preview():
+            self.doc.close()  # full image replace its preview
+            self.doc = None
+        if doc.reduced == 1:
+            self.docs.append(doc)
+        self.activate(doc, keep_crop)
+        self.status_var.set(f"Loaded image: {os.path.basename(doc.path)}")
+        if doc.frames is not None:
+            self.status_var.set(
+                f"Loaded {os.path.basename(doc.path)}: {doc.frames.count} frames, "
+                "PgUp/PgDn change frame, save as gif or tiff keep all frames"
+            )
+        self.startup_mark("first image")  # preview count, user see pixel
+        if doc.reduced == 1:
+            self.startup_mark("full image")
 
-        # make window resize friendly
-        main_frame.columnconfigure(0, weight=1)
-        main_frame.columnconfigure(1, weight=1)
-        main_frame.rowconfigure(0, weight=1)
-        main_frame.rowconfigure(1, weight=0)
+    def activate(self, doc, keep_crop=False):
+        """show doc with its own slider edits, reload pixel if it was unloaded"""
+        self.doc = doc
+        self.render_worker.cancel()
 
-    def load_image(self):
-        """open file and show image"""
-        file_path = filedialog.askopenfilename(
-            filetypes=[
-                ("Image files", "*.jpg *.jpeg *.png *.bmp *.gif"),
-                ("All files", "*.*"),
-            ]
-        )
+        # remove old crop rectangle
+        if self.crop_rectangle and not keep_crop:
+            self.original_canvas.delete(self.crop_rectangle)
+            self.crop_rectangle = None
 
-        if file_path:
-            try:
-                self.current_file_path = file_path
-                self.original_image = cv2.imread(file_path)
-                self.original_image = cv2.cvtColor(
-                    self.original_image, cv2.COLOR_BGR2RGB
-                )
-                self.displayed_image = self.original_image.copy()
-                self.current_image = self.displayed_image.copy()
+        # show image in both side, proxy is there even when doc is unloaded
+        for viewer in self.viewers.values():
+            viewer.reset()  # new image start zoom to fit
+        self.show_base(self.original_canvas, original=True)
+        self.show_base(self.processed_canvas)
 
-                # remove old crop rectangle
-                if self.crop_rectangle:
-                    self.original_canvas.delete(self.crop_rectangle)
-                    self.crop_rectangle = None
+        # slider show edits of this document, not applied yet
+        self.show_sliders(doc.edits)
+        if doc.edits:
+            name = next(iter(doc.edits))
+            self.preview_edit(name, doc.edits[name])  # slider may not call back
 
-                # show image in both side
-                self.show_image(self.original_image, self.original_canvas)
-                self.show_image(self.original_image, self.processed_canvas)
+        # crop box was in preview pixel, map same rectangle to full size
+        if self.crop_rectangle and self.start_x is not None and self.end_x is not None:
+            self.preview_crop()
 
-                # reset slider to default
-                self.resize_slider.set(100)
-                self.brightness_slider.set(0)
+        if doc.reduced == 1:
+            if doc.loaded():
+                self.doc_cache.touch(doc)  # may unload other documents
+            else:
+                self.restore_document(doc)
+        self.refresh_documents_menu()
 
-                # clear undo/redo
-                self.history = [self.original_image.copy()]
-                self.history_position = 0
+    def restore_document(self, doc):
+        """decode source file again for document that was unloaded"""
 
-                self.status_var.set(f"Loaded image: {os.path.basename(file_path)}")
-            except Exception as e:
-                self.status_var.set(f"Error loading image: {str(e)}")
+        def job(task):
+            if doc.frames is not None:
+                image = doc.frames.read(doc.frame_index)
+            else:
+                image = read_image_file(doc.path, task)
+            task.progress(0.9, "Making proxy")
+            return image, build_pyramid(image)
 
-    def show_image(self, image, canvas):
-        """show image in canvas area"""
-        if image is None:
+        def done(result):
+            doc.restore(*result)
+            if doc is self.doc:
+                self.activate(doc)  # full size proxy and edits preview
+                self.status_var.set(f"Reloaded image: {os.path.basename(doc.path)}")
+            else:
+                self.doc_cache.touch(doc)
+
+        def failed(error):
+            if isinstance(error, IOCancelled):
+                self.status_var.set("Reloading cancelled, image stay unloaded")
+            else:
+                self.status_var.set(f"Error reloading image: {str(error)}")
+
+        self.start_io("load", job, done, failed, os.path.basename(doc.path))
+
+    def step_frame(self, step):
+        """show next (1) or previous (-1) frame of gif or tiff, edits stay"""
+        doc = self.doc
+        if doc is None or doc.frames is None:
+            return
+        if self.io_task is not None or self.editing_locked():
+            self.status_var.set("Wait, file is still loading or saving")
+            return
+        index = (doc.frame_index + step) % doc.frames.count
+
+        def done(result):
+            if doc.frames is None or doc is not self.doc:
+                return  # document closed or switched while decoding
+            doc.set_frame(*result)
+            self.activate(doc)
+            self.status_var.set(
+                f"Frame {index + 1}/{doc.frames.count} of {os.path.basename(doc.path)}"
+            )
+
+        def failed(error):
+            self.status_var.set(f"Error reading frame: {str(error)}")
+
+        self.start_io("load", doc.frame_job(index), done, failed, f"frame {index + 1}")
+
+    def switch_document(self, doc):
+        """show other open document"""
+        if doc is self.doc:
+            return
+        if self.io_task is not None:
+            self.status_var.set("Wait, file is still loading or saving")
+            self.refresh_documents_menu()  # menu mark go back to shown one
+            return
+        self.activate(doc)
+        self.status_var.set(f"Showing {os.path.basename(doc.path)}")
+
+    def cycle_document(self, step):
+        """show next (1) or previous (-1) open document"""
+        if not self.docs:
             return
+        if self.doc in self.docs:
+            index = (self.docs.index(self.doc) + step) % len(self.docs)
+        else:
+            index = 0
+        self.switch_document(self.docs[index])
+        return "break"  # tk keep ctrl+tab for focus move otherwise
+
+    def close_document(self):
+        """close shown document, its history is gone"""
+        if self.doc is None:
+            return
+        if self.io_task is not None:
+            self.status_var.set("Wait, file is still loading or saving")
+            return
+        name = os.path.basename(self.doc.path)
+        self.drop_document()
+        self.status_var.set(f"Closed {name}")
+
+    def trim_documents(self):
+        """shown document grew, unload old ones if over memory budget"""
+        if self.doc is not None and self.doc.reduced == 1:
+            if self.doc_cache.touch(self.doc):
+                self.refresh_documents_menu()
+
+    def refresh_documents_menu(self):
+        """list open documents in menu, unloaded one is marked"""
+        self.documents_menu.delete(self.documents_menu_fixed, tk.END)
+        for index, doc in enumerate(self.docs):
+            label = os.path.basename(doc.path)
+            if not doc.loaded():
+                label += " (unloaded)"
+            self.documents_menu.add_radiobutton(
+                label=label,
+                variable=self.doc_choice,
+                value=index,
+                command=functools.partial(self.switch_document, doc),
+            )
+        self.doc_choice.set(self.docs.index(self.doc) if self.doc in self.docs else -1)
+
+    def start_io(self, kind, job, on_done, on_error, name):
+        """run load or save job, lock controls until it finish"""
+        label = "Loading" if kind == "load" else "Saving"
 
+        def progress(percent, text):
+            self.status_var.set(f"{label} {name}: {text} {percent}%")
+
+        def finish(callback, value):
+            self.set_busy(None)
+            callback(value)
+
+        self.set_busy(kind)
+        self.status_var.set(f"{label} {name}...")
+        self.io_task = self.io_service.submit(
+            job,
+            functools.partial(finish, on_done),
+            functools.partial(finish, on_error),
+            on_progress=progress,
+        )
+
+    def set_busy(self, kind):
+        """disable controls while file job run, None enable them again"""
+        self.io_kind = kind
+        if kind is None:
+            self.io_task = None
+
+        # load replace the image so no editing, save work on a snapshot
+        file_widgets = [self.load_btn, self.save_btn]
+        edit_widgets = [
+            self.reset_crop_btn,
+            self.apply_crop_btn,
+            self.apply_edit_btn,
+            self.resize_slider,
+            self.brightness_slider,
+            self.contrast_slider,
+            self.gamma_slider,
+            *self.filter_sliders.values(),
+        ]
+        for widget in file_widgets:
+            widget.state(["disabled"] if kind else ["!disabled"])
+        for widget in edit_widgets:
+            widget.state(["disabled"] if kind == "load" else ["!disabled"])
+        self.cancel_btn.state(["!disabled"] if kind else ["disabled"])
+
+    def editing_locked(self):
+        """True while a new image is loading or shown one is unloaded"""
+        if self.doc is not None and not self.doc.loaded():
+            return True
+        return self.io_kind == "load"
+
+    def cancel_io(self):
+        """ask running load or save to stop"""
+        if self.io_task is not None:
+            self.io_task.cancel()
+            self.status_var.set("Cancelling...")
+
+    def canvas_size(self, canvas):
+        """canvas width and height, 500 when not drawn yet"""
         canvas_width = canvas.winfo_width()
         canvas_height = canvas.winfo_height()
         if canvas_width <= 1 or canvas_height <= 1:
             canvas_width = 500
             canvas_height = 500
+        return canvas_width, canvas_height
 
-        img_height, img_width = image.shape[:2]
-        scaling = min(canvas_width / img_width, canvas_height / img_height)
-        new_width = int(img_width * scaling)
-        new_height = int(img_height * scaling)
+    def get_proxy(self, canvas, original=False):
+        """small level of image that match canvas size"""
+        if self.doc is None:
+            return None
+        return self.doc.proxy(*self.canvas_size(canvas), original=original)
+
+    def base_version(self, original=False):
+        """display cache key of original or current history image"""
+        if original:
+            return ("original", self.doc.serial)
+        state_id = self.doc.history.current_id()
+        if state_id is None:
+            return None  # unloaded document, its proxy frame is not cached
+        return ("state", state_id)
+
+    def show_base(self, canvas, original=False):
+        """show original or current history image, use proxy for fast"""
+        version = self.base_version(original)
+        if not self.zoom_mode.get():
+            frame = self.displays[canvas].lookup(version, self.canvas_size(canvas))
+            if frame is not None:
+                # seen before, no proxy, resize or conversion needed
+                self.viewers[canvas].clear_items()
+                self.displays[canvas].put(frame)
+                TRACER.end_frame()
+                return
+
+        proxy = self.get_proxy(canvas, original=original)
+        pyramid = self.doc.original_pyramid if original else self.doc.proxy_pyramid
+        self.show_image(proxy, canvas, pyramid=pyramid, version=version)
+
+    def show_image(self, image, canvas, pyramid=None, full_width=None, version=None):
+        """show image in canvas area, version is key for display cache"""
+        if image is None:
+            return
+
+        if self.zoom_mode.get():
+            # full_width is width of full size image when image is a proxy
+            self.displays[canvas].hide()
+            with TRACER.span("view draw"):
+                self.viewers[canvas].show(pyramid or [image], full_width)
+            TRACER.end_frame()
+            return
+        self.viewers[canvas].clear_items()
+
+        display = self.displays[canvas]
+        canvas_size = self.canvas_size(canvas)
+        frame = display.lookup(version, canvas_size)
+        if frame is None:
+            frame = display.make_frame(image, version, canvas_size)
+        display.put(frame)
+        TRACER.end_frame()
 
-        display_image = cv2.resize(image, (new_width, new_height))
-        photo = ImageTk.PhotoImage(image=Image.fromarray(display_image))
+    def toggle_timing(self):
+        """show or hide stage timing in status bar, start or stop recording"""
+        TRACER.configure(self.timing_overlay.get(), self.trace_recording.get())
+        if self.timing_overlay.get():
+            self.timing_frame = -1  # show last frame right away
+            self.timing_bar.pack(side=tk.RIGHT)
+        else:
+            self.timing_bar.pack_forget()
 
-        canvas.config(width=new_width, height=new_height)
-        canvas.delete("all")
-        canvas.create_image(
-            new_width // 2, new_height // 2, image=photo, anchor=tk.CENTER
+    def export_trace(self):
+        """save recorded stage timing as chrome trace json"""
+        if not TRACER.events:
+            self.status_var.set("No trace recorded, turn on File > Record Trace first")
+            return
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            initialfile="trace.json",
+            filetypes=[("Chrome trace", "*.json"), ("All files", "*.*")],
+        )
+        if not file_path:
+            return
+        try:
+            count = TRACER.export(file_path)
+        except OSError as e:
+            self.status_var.set(f"Error saving trace: {str(e)}")
+            return
+        self.status_var.set(
+            f"Trace saved: {os.path.basename(file_path)} ({count} events), "
+            "open in chrome://tracing or ui.perfetto.dev"
         )
-        canvas.image = photo  # don't delete by python garbage
+
+    def toggle_zoom(self):
+        """change between fit view and zoom/pan view"""
+        if self.crop_rectangle:
+            self.original_canvas.delete(self.crop_rectangle)
+            self.crop_rectangle = None
+        self.is_drawing = False
+        for viewer in self.viewers.values():
+            viewer.reset()
+        if self.doc is None:
+            return
+        self.show_base(self.original_canvas, original=True)
+        self.show_base(self.processed_canvas)
+        if self.zoom_mode.get():
+            self.status_var.set("Zoom/Pan Mode: wheel to zoom, right drag to move")
+        else:
+            self.status_var.set("Fit view")
+
+    def on_wheel(self, viewer, event):
+        """mouse wheel zoom in zoom mode"""
+        if not self.zoom_mode.get():
+            return
+        zoom_in = event.num == 4 or getattr(event, "delta", 0) > 0
+        viewer.zoom_at(1.25 if zoom_in else 0.8, event.x, event.y)
+        self.status_var.set(f"Zoom {viewer.zoom * 100:.0f}%")
+
+    def start_pan(self, viewer, event):
+        """right mouse press in zoom mode"""
+        if self.zoom_mode.get():
+            viewer.start_pan(event)
+
+    def on_pan(self, viewer, event):
+        """right mouse drag move image in zoom mode"""
+        if self.zoom_mode.get():
+            viewer.pan(event)
 
     def start_crop(self, event):
         """mouse start draw"""
-        if self.original_image is None:
+        if self.doc is None:
+            return
+        if self.editing_locked() and not self.showing_preview():
+            return  # old image is about to be replaced
+        if self.zoom_mode.get():
+            self.status_var.set("Crop work only when Zoom/Pan Mode is off")
             return
 
         self.start_x = self.original_canvas.canvasx(event.x)
@@ -265,7 +3508,7 @@ class ImageProcessingApp:
 
     def update_crop(self, event):
         """while dragging mouse"""
-        if not self.is_drawing or self.original_image is None:
+        if not self.is_drawing or self.doc is None or self.zoom_mode.get():
             return
 
         self.end_x = self.original_canvas.canvasx(event.x)
@@ -275,11 +3518,11 @@ class ImageProcessingApp:
             self.crop_rectangle, self.start_x, self.start_y, self.end_x, self.end_y
         )
 
-        self.preview_crop()  # show small preview right side
+        self.schedule_crop_preview()  # show small preview right side
 
     def end_crop(self, event):
         """mouse release"""
-        if not self.is_drawing or self.original_image is None:
+        if not self.is_drawing or self.doc is None or self.zoom_mode.get():
             return
 
         self.is_drawing = False
@@ -291,44 +3534,70 @@ class ImageProcessingApp:
         )
         self.preview_crop()
 
+    def schedule_crop_preview(self):
+        """mouse move come faster than screen, draw at most once a frame"""
+        if not self.crop_preview_waiting:
+            self.crop_preview_waiting = True
+            self.root.after(CROP_PREVIEW_MS, self.preview_crop)
+
     def preview_crop(self):
         """show small image of selected part"""
-        if self.original_image is None or self.start_x is None or self.end_x is None:
+        self.crop_preview_waiting = False
+        if self.doc is None or self.start_x is None or self.end_x is None:
             return
 
-        canvas_width = self.original_canvas.winfo_width()
-        canvas_height = self.original_canvas.winfo_height()
-        if canvas_width <= 1 or canvas_height <= 1:
-            canvas_width = 500
-            canvas_height = 500
+        # map mouse on shown frame to full size pixel
+        display = self.displays[self.original_canvas]
+        if display.photo is not None:
+            shown_width, shown_height = display.photo.width(), display.photo.height()
+        else:
+            shown_width, shown_height = self.canvas_size(self.original_canvas)
 
-        img_height, img_width = self.original_image.shape[:2]
-        scale_x = img_width / canvas_width
-        scale_y = img_height / canvas_height
+        img_height, img_width = self.doc.original_image.shape[:2]
+        scale_x = img_width / shown_width
+        scale_y = img_height / shown_height
 
         x1 = max(0, int(min(self.start_x, self.end_x) * scale_x))
         y1 = max(0, int(min(self.start_y, self.end_y) * scale_y))
         x2 = min(img_width, int(max(self.start_x, self.end_x) * scale_x))
         y2 = min(img_height, int(max(self.start_y, self.end_y) * scale_y))
 
-        self.temp_image = self.original_image[y1:y2, x1:x2].copy()
+        self.doc.select_crop((x1, y1, x2, y2))
+        self.show_sliders(self.doc.edits)  # crop drop pending slider edits
+        self.render_worker.cancel()
+        if not self.doc.crop_valid():
+            return
 
-        if self.temp_image.size > 0:
-            self.show_image(self.temp_image, self.processed_canvas)
+        # smallest level where the selection still fill the canvas, cut from
+        # it is a view only, no copy
+        canvas_width, canvas_height = self.canvas_size(self.processed_canvas)
+        proxy = pick_level(
+            self.doc.original_pyramid,
+            canvas_width * img_width / (x2 - x1),
+            canvas_height * img_height / (y2 - y1),
+        )
+        level_scale = proxy.shape[1] / img_width
+        box = [int(v * level_scale) for v in self.doc.crop_box]
+        box[2], box[3] = max(box[2], box[0] + 1), max(box[3], box[1] + 1)
+        self.show_image(crop_op(proxy, box), self.processed_canvas)
 
     def apply_crop(self):
         """apply crop image"""
-        if self.temp_image is None or self.temp_image.size == 0:
+        if self.editing_locked() or self.doc is None:
+            return
+        if not self.doc.apply_crop():
             self.status_var.set("No valid crop selection")
             return
 
-        self.current_image = self.temp_image.copy()
-        self.add_to_history(self.current_image)
-        self.show_image(self.current_image, self.processed_canvas)
+        self.render_worker.cancel()  # preview of old base is not good now
+        self.show_base(self.processed_canvas)
+        self.trim_documents()
         self.status_var.set("Crop applied")
 
     def reset_crop(self):
         """remove crop and back to normal"""
+        if self.editing_locked():
+            return
         if self.crop_rectangle:
             self.original_canvas.delete(self.crop_rectangle)
             self.crop_rectangle = None
@@ -338,68 +3607,156 @@ class ImageProcessingApp:
         self.end_x = None
         self.end_y = None
 
-        if self.original_image is not None:
-            self.show_image(self.original_image, self.processed_canvas)
-            self.current_image = self.original_image.copy()
+        if self.doc is not None:
+            self.doc.reset_crop()
+            self.show_image(
+                self.get_proxy(self.processed_canvas, original=True),
+                self.processed_canvas,
+                pyramid=self.doc.original_pyramid,
+                version=self.base_version(original=True),
+            )
 
         self.status_var.set("Crop selection reset")
 
-    def resize_image(self, value):
-        """resize image using slider"""
-        if self.current_image is None:
+    def preview_edit(self, name, value):
+        """show slider edits on the proxy, full size wait for apply or save"""
+        if self.doc is None or self.editing_locked() or self.syncing_sliders:
             return
 
-        percentage = float(value)
-        if self.history_position >= 0 and self.history_position < len(self.history):
-            base_image = self.history[self.history_position].copy()
+        # every slider keep its value, all of them run together
+        doc = self.doc
+        doc.set_edit(name, value)
+        if not doc.edits:
+            self.render_worker.cancel()
+            self.show_base(self.processed_canvas)
+            return
 
-            if percentage == 100:
-                self.show_image(base_image, self.processed_canvas)
-                return
+        render = doc.preview_job(
+            *self.canvas_size(self.processed_canvas), self.preview_pool
+        )
+        steps = doc.edit_steps()
+        full_width = doc.history.current().shape[1] * doc.edits.get("resize", 100)
+        full_width /= 100
+        message = ", ".join(
+            EDIT_LABELS[step["op"]].format(step["value"]) for step in steps
+        )
 
-            height, width = base_image.shape[:2]
-            new_width = int(width * percentage / 100)
-            new_height = int(height * percentage / 100)
+        def done(preview):
+            if self.zoom_mode.get():
+                # viewer keep image to cut tiles on pan, but preview is pool
+                # buffer that a later render write again
+                preview = preview.copy()
+            self.show_image(preview, self.processed_canvas, full_width=full_width)
+            self.status_var.set(f"{message} ({self.render_worker.stats()})")
 
-            resized = cv2.resize(
-                base_image, (new_width, new_height), interpolation=cv2.INTER_AREA
-            )
+        def failed(error):
+            self.status_var.set(f"Error in preview: {str(error)}")
+
+        self.render_worker.submit(render, done, on_error=failed)
 
-            self.show_image(resized, self.processed_canvas)
-            self.temp_image = resized
-            self.status_var.set(f"Resized to {percentage:.0f}%")
+    def resize_image(self, value):
+        """resize image using slider"""
+        self.preview_edit("resize", float(value))
 
     def adjust_brightness(self, value):
         """change brightness"""
-        if self.current_image is None or self.history_position < 0:
+        self.preview_edit("brightness", float(value))
+
+    def adjust_contrast(self, value):
+        """change contrast"""
+        self.preview_edit("contrast", float(value))
+
+    def adjust_gamma(self, value):
+        """change gamma"""
+        self.preview_edit("gamma", float(value))
+
+    def adjust_filter(self, name, value):
+        """change blur, sharpen, denoise or local contrast"""
+        self.preview_edit(name, float(value))
+
+    def measure_filter_speedup(self):
+        """time filter sliders on full size image, tiled against one thread"""
+        if self.doc is None or self.editing_locked():
             return
+        filters = [
+            (name, self.doc.edits[name]) for name in FILTERS if name in self.doc.edits
+        ]
+        if not filters:
+            self.status_var.set("Move a filter slider first")
+            return
+        # undo fix history frame in place, worker time its own copy
+        image = self.doc.history.current().copy()
+
+        def render():
+            return [
+                (name, FILTER_ENGINE.speedup(image, name, value))
+                for name, value in filters
+            ]
 
-        brightness = float(value)
-        base_image = self.history[self.history_position].copy()
+        def done(results):
+            parts = [
+                f"{name} {stats['speedup']:.1f}x "
+                f"({stats['single_ms']:.0f} -> {stats['tiled_ms']:.0f} ms"
+                f"{'' if stats['same'] else ', result differs'})"
+                for name, stats in results
+            ]
+            self.status_var.set(
+                f"Filter speedup on {FILTER_ENGINE.workers} threads: "
+                + ", ".join(parts)
+            )
 
-        adjusted = base_image.copy()
-        adjusted = cv2.convertScaleAbs(adjusted, alpha=1, beta=brightness)
+        def failed(error):
+            self.status_var.set(f"Error in speedup test: {str(error)}")
 
-        self.show_image(adjusted, self.processed_canvas)
-        self.temp_image = adjusted
-        self.status_var.set(f"Brightness adjusted: {brightness:.0f}")
+        self.status_var.set("Measuring filter speedup...")
+        self.render_worker.submit(render, done, on_error=failed)
 
-    def save_image(self, event=None):
-        """save image to file"""
-        if self.current_image is None and self.temp_image is None:
-            self.status_var.set("No image to save")
+    def reset_sliders(self):
+        """all slider back to no change"""
+        self.show_sliders({})
+        if self.doc is not None:
+            self.doc.edits = {}
+
+    def show_sliders(self, edits):
+        """put slider at edit values, slider without edit go to no change,
+        scale set() call the slider command so it is ignored meanwhile"""
+        self.syncing_sliders = True
+        try:
+            self.resize_slider.set(edits.get("resize", SLIDER_NEUTRAL["resize"]))
+            self.brightness_slider.set(
+                edits.get("brightness", SLIDER_NEUTRAL["brightness"])
+            )
+            self.contrast_slider.set(edits.get("contrast", SLIDER_NEUTRAL["contrast"]))
+            self.gamma_slider.set(edits.get("gamma", SLIDER_NEUTRAL["gamma"]))
+            for name, slider in self.filter_sliders.items():
+                slider.set(edits.get(name, SLIDER_NEUTRAL[name]))
+        finally:
+            self.syncing_sliders = False
+
+    def apply_edit(self):
+        """run slider edits on full size image and keep in history"""
+        if self.editing_locked() or self.doc is None:
+            return
+        if not self.doc.apply_edits():
+            self.status_var.set("No edit to apply")
             return
 
-        save_image = (
-            self.temp_image if self.temp_image is not None else self.current_image
-        )
+        self.render_worker.cancel()  # preview of old base is not good now
+        self.show_base(self.processed_canvas)
+        self.trim_documents()
+
+        # edit is inside the image now, slider back to normal
+        self.reset_sliders()
+        self.status_var.set("Edit applied")
 
-        if save_image is None:
+    def save_image(self, event=None):
+        """save image to file"""
+        if self.doc is None:
             self.status_var.set("No image to save")
             return
 
-        if self.current_file_path:
-            directory, filename = os.path.split(self.current_file_path)
+        if self.doc.path:
+            directory, filename = os.path.split(self.doc.path)
             name, ext = os.path.splitext(filename)
             default_path = os.path.join(directory, f"{name}_edited{ext}")
         else:
@@ -409,13 +3766,15 @@ class ImageProcessingApp:
 
     def save_image_as(self, default_path=None):
         """save image as new file name"""
-        if self.current_image is None and self.temp_image is None:
+        if self.io_task is not None:
+            self.status_var.set("Wait, file is still loading or saving")
+            return
+        if self.doc is None:
             self.status_var.set("No image to save")
             return
-
-        save_image = (
-            self.temp_image if self.temp_image is not None else self.current_image
-        )
+        if self.editing_locked():
+            self.status_var.set("Wait, image is not loaded yet")
+            return
 
         if default_path is None:
             default_path = "untitled.png"
@@ -425,6 +3784,9 @@ class ImageProcessingApp:
             filetypes=[
                 ("PNG files", "*.png"),
                 ("JPEG files", "*.jpg"),
+                ("WebP files", "*.webp"),
+                ("GIF files, all frames", "*.gif"),
+                ("TIFF files, all frames", "*.tif"),
                 ("All files", "*.*"),
             ],
             initialfile=os.path.basename(default_path),
@@ -432,46 +3794,904 @@ class ImageProcessingApp:
 
         if file_path:
             try:
-                save_image_bgr = cv2.cvtColor(save_image, cv2.COLOR_RGB2BGR)
-                cv2.imwrite(file_path, save_image_bgr)
-                self.status_var.set(f"Image saved as {os.path.basename(file_path)}")
-            except Exception as e:
+                # full size pass only on io thread
+                job = self.doc.save_job(
+                    file_path, EXPORT_PRESETS[self.export_preset.get()]
+                )
+            except ValueError as e:
                 self.status_var.set(f"Error saving image: {str(e)}")
+                return
+
+            def done(report):
+                self.status_var.set(f"Image saved: {export_summary([report])}")
+
+            def failed(error):
+                if isinstance(error, IOCancelled):
+                    self.status_var.set("Saving cancelled")
+                else:
+                    self.status_var.set(f"Error saving image: {str(error)}")
+
+            self.start_io("save", job, done, failed, os.path.basename(file_path))
+
+    def show_export(self):
+        """open export dialog, or bring it to front"""
+        if self.doc is None:
+            self.status_var.set("No image to export")
+            return
+        if self.export_dialog is None or not self.export_dialog.exists():
+            self.export_dialog = ExportDialog(
+                self.root, self.export_preset, self.export
+            )
+        self.export_dialog.lift()
+
+    def export(self, base_path, formats, sizes):
+        """write shown image in every format and size at once"""
+        if self.io_task is not None:
+            self.status_var.set("Wait, file is still loading or saving")
+            return
+        if self.doc is None:
+            self.status_var.set("No image to export")
+            return
+        if self.editing_locked():
+            self.status_var.set("Wait, image is not loaded yet")
+            return
+
+        targets = export_targets(base_path, formats, sizes)
+        job = self.doc.export_job(targets, EXPORT_PRESETS[self.export_preset.get()])
+        start = time.perf_counter()
+
+        def done(reports):
+            summary = export_summary(reports, time.perf_counter() - start)
+            self.status_var.set(f"Exported {summary}")
+
+        def failed(error):
+            if isinstance(error, IOCancelled):
+                self.status_var.set("Export cancelled, finished files are kept")
+            else:
+                self.status_var.set(f"Error exporting image: {str(error)}")
+
+        self.start_io("save", job, done, failed, os.path.basename(base_path))
+
+    def save_session(self):
+        """write history and edits of shown image to session file"""
+        if self.io_task is not None:
+            self.status_var.set("Wait, file is still loading or saving")
+            return
+        if self.doc is None or self.editing_locked():
+            self.status_var.set("No image to save")
+            return
+
+        name = os.path.splitext(os.path.basename(self.doc.path))[0]
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".imgsession",
+            initialfile=f"{name}.imgsession",
+            filetypes=[("Session files", "*.imgsession"), ("All files", "*.*")],
+        )
+        if not file_path:
+            return
+
+        job = session_job(self.doc, file_path)  # pick arrays now, write on io
+
+        def done(size):
+            self.status_var.set(
+                f"Session saved as {os.path.basename(file_path)} "
+                f"({size / (1024 * 1024):.1f} MB)"
+            )
+
+        def failed(error):
+            if isinstance(error, IOCancelled):
+                self.status_var.set("Saving cancelled")
+            else:
+                self.status_var.set(f"Error saving session: {str(error)}")
+
+        self.start_io("save", job, done, failed, os.path.basename(file_path))
 
-    def add_to_history(self, image):
-        """keep image in undo list"""
-        if self.history_position < len(self.history) - 1:
-            self.history = self.history[: self.history_position + 1]
+    def open_session(self):
+        """open session file, pixel is memory mapped so it is quick"""
+        if self.io_task is not None:
+            self.status_var.set("Wait, file is still loading or saving")
+            return
+        file_path = filedialog.askopenfilename(
+            filetypes=[("Session files", "*.imgsession"), ("All files", "*.*")]
+        )
+        if not file_path:
+            return
 
-        self.history.append(image.copy())
+        def done(doc):
+            self.install_document(doc)
+            self.status_var.set(
+                f"Session opened: {os.path.basename(file_path)}, "
+                f"{len(doc.history)} history steps"
+            )
 
-        if len(self.history) > self.max_history:
-            self.history.pop(0)
+        def failed(error):
+            self.status_var.set(f"Error opening session: {str(error)}")
 
-        self.history_position = len(self.history) - 1
+        self.start_io(
+            "load",
+            lambda task: load_session(file_path),
+            done,
+            failed,
+            os.path.basename(file_path),
+        )
 
     def undo(self, event=None):
         """go back one step"""
-        if self.history_position > 0:
-            self.history_position -= 1
-            self.current_image = self.history[self.history_position].copy()
-            self.show_image(self.current_image, self.processed_canvas)
+        if self.editing_locked() or self.doc is None:
+            return
+        if self.doc.undo():
+            self.show_sliders(self.doc.edits)  # pending edits are dropped
+            self.render_worker.cancel()
+            self.show_base(self.processed_canvas)
             self.status_var.set("Undo")
         else:
             self.status_var.set("Nothing to undo")
 
     def redo(self, event=None):
         """go forward one step"""
-        if self.history_position < len(self.history) - 1:
-            self.history_position += 1
-            self.current_image = self.history[self.history_position].copy()
-            self.show_image(self.current_image, self.processed_canvas)
+        if self.editing_locked() or self.doc is None:
+            return
+        if self.doc.redo():
+            self.show_sliders(self.doc.edits)  # pending edits are dropped
+            self.render_worker.cancel()
+            self.show_base(self.processed_canvas)
             self.status_var.set("Redo")
         else:
             self.status_var.set("Nothing to redo")
 
 
-if __name__ == "__main__":
+# file type that batch pick from input folder
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+
+
+def iter_images(in_dir):
+    """walk folder and give image path one by one, no full list in memory"""
+    folders = [in_dir]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTS):
+                    yield entry.path
+
+
+def batch_output_path(in_path, in_dir, out_dir, ext=None):
+    """same relative path in output folder, ext change file type"""
+    relative = os.path.relpath(in_path, in_dir)
+    if ext:
+        relative = os.path.splitext(relative)[0] + "." + ext.lstrip(".")
+    return os.path.join(out_dir, relative)
+
+
+def process_file(in_path, out_path, recipe, preset=None):
+    """worker job: read, edit and write one file, return bytes in and out"""
+    image = cv2.imread(in_path)
+    if image is None:
+        raise ValueError(f"cannot read {in_path}")
+    result = apply_recipe(image, recipe)
+    params = encode_params(out_path, preset)
+    return os.path.getsize(in_path), write_image_atomic(out_path, result, params)
+
+
+def run_batch(
+    recipe, in_dir, out_dir, workers=None, in_flight=None, ext=None, preset=None
+):
+    """edit every image of in_dir into out_dir on process pool"""
+    workers = workers or os.cpu_count() or 1
+    in_flight = in_flight or workers * 2  # max image in memory at same time
+    done = skipped = failed = 0
+    bytes_in = bytes_out = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        paths = iter_images(in_dir)
+        finished = False
+        while not finished or running:
+            # fill pool until in flight limit, listing go only as fast as work
+            while not finished and len(running) < in_flight:
+                in_path = next(paths, None)
+                if in_path is None:
+                    finished = True
+                    break
+                out_path = batch_output_path(in_path, in_dir, out_dir, ext)
+                if os.path.exists(out_path):
+                    skipped += 1  # done in earlier run, output is always complete
+                    continue
+                future = pool.submit(process_file, in_path, out_path, recipe, preset)
+                running[future] = in_path
+
+            if not running:
+                continue
+            complete, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in complete:
+                in_path = running.pop(future)
+                try:
+                    size_in, size_out = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"error: {in_path}: {e}", file=sys.stderr)
+                    continue
+                done += 1
+                bytes_in += size_in
+                bytes_out += size_out
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    return {
+        "done": done,
+        "skipped": skipped,
+        "failed": failed,
+        "seconds": elapsed,
+        "images_per_sec": done / elapsed,
+        "mb_per_sec": bytes_in / elapsed / (1024 * 1024),
+        "mb_written": bytes_out / (1024 * 1024),
+    }
+
+
+def batch_main(argv):
+    """command line: batch --recipe ops.json in_dir out_dir"""
+    parser = argparse.ArgumentParser(prog="1.py batch")
+    parser.add_argument("--recipe", required=True, help="json list of edit steps")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--in-flight", type=int, default=None)
+    parser.add_argument("--ext", default=None, help="output type, like png")
+    parser.add_argument(
+        "--preset", choices=list(EXPORT_PRESETS), default=None, help="encoder settings"
+    )
+    parser.add_argument("in_dir")
+    parser.add_argument("out_dir")
+    args = parser.parse_args(argv)
+
+    try:
+        recipe = load_recipe(args.recipe)
+    except (OSError, ValueError) as e:
+        parser.error(f"cannot use recipe {args.recipe}: {e}")
+    stats = run_batch(
+        recipe,
+        args.in_dir,
+        args.out_dir,
+        args.workers,
+        args.in_flight,
+        args.ext,
+        args.preset,
+    )
+    print(
+        f"{stats['done']} done, {stats['skipped']} skipped (already done), "
+        f"{stats['failed']} failed in {stats['seconds']:.1f}s: "
+        f"{stats['images_per_sec']:.2f} images/sec, "
+        f"{stats['mb_per_sec']:.2f} MB/sec read"
+    )
+    return 1 if stats["failed"] else 0
+
+
+WATCH_POLL = 1.0  # seconds between two look at ingest folder
+WATCH_STABLE_POLLS = 2  # file size and time same this many poll, then it is complete
+WATCH_STABLE_SECONDS = 1.0  # and not changed for this long, for fast poll
+WATCH_STATS_EVERY = 10.0  # seconds between two write of stats file
+WATCH_LATENCY_KEEP = 10_000  # last latency kept for percentile
+
+
+# poll folder, give each image once its size stop changing
+class StableFileScanner:
+    def __init__(
+        self,
+        in_dir,
+        stable_polls=WATCH_STABLE_POLLS,
+        stable_seconds=WATCH_STABLE_SECONDS,
+    ):
+        self.in_dir = in_dir
+        self.stable_polls = stable_polls
+        self.stable_seconds = stable_seconds
+        # path -> (size, mtime, same count, last change time, first seen time)
+        self.growing = {}
+        self.taken = {}  # path -> (size, mtime) given out, again only if changed
+
+    def poll(self, now=None):
+        """one look at folder, return list of (path, first seen time) now complete"""
+        now = time.perf_counter() if now is None else now
+        ready = []
+        present = set()
+        for path in iter_images(self.in_dir):
+            if os.path.basename(path).startswith("."):
+                continue  # temp file of writer, like our own .part- file
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                continue  # removed between list and stat
+            present.add(path)
+            signature = (info.st_size, info.st_mtime_ns)
+            if self.taken.get(path) == signature:
+                continue
+            size, mtime, same, changed, first_seen = self.growing.get(
+                path, (None, None, 0, now, now)
+            )
+            if (size, mtime) == signature:
+                same += 1
+            else:
+                same, changed = 0, now
+            stable = same >= self.stable_polls - 1
+            if stable and now - changed >= self.stable_seconds and info.st_size:
+                self.growing.pop(path, None)
+                self.taken[path] = signature
+                ready.append((path, first_seen))
+            else:
+                self.growing[path] = (*signature, same, changed, first_seen)
+
+        # forget removed file, same name coming again is a new file
+        for table in (self.growing, self.taken):
+            for path in [path for path in table if path not in present]:
+                del table[path]
+        return ready
+
+
+# counters of watch mode, shared by worker threads
+class WatchStats:
+    def __init__(self, keep=WATCH_LATENCY_KEEP):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.window_start = self.start
+        self.counts = {"queued": 0, "done": 0, "skipped": 0, "failed": 0}
+        self.bytes_in = self.bytes_out = 0
+        self.window_done = 0
+        self.latency_ms = deque(maxlen=keep)  # first seen to output written
+        self.wait_ms = deque(maxlen=keep)  # time in queue
+        self.work_ms = deque(maxlen=keep)  # read, edit and write
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def finished(self, first_seen, queued, started, size_in, size_out):
+        end = time.perf_counter()
+        with self.lock:
+            self.counts["done"] += 1
+            self.window_done += 1
+            self.bytes_in += size_in
+            self.bytes_out += size_out
+            self.latency_ms.append((end - first_seen) * 1000)
+            self.wait_ms.append((started - queued) * 1000)
+            self.work_ms.append((end - started) * 1000)
+
+    @staticmethod
+    def percentiles(values):
+        if not values:
+            return None
+        percent = np.percentile(values, [50, 90, 99])
+        return {
+            "p50": round(float(percent[0]), 1),
+            "p90": round(float(percent[1]), 1),
+            "p99": round(float(percent[2]), 1),
+            "max": round(float(max(values)), 1),
+        }
+
+    def snapshot(self, queue_depth, in_work, waiting):
+        """stats dict, rate of last window start again after each call"""
+        now = time.perf_counter()
+        with self.lock:
+            uptime = max(now - self.start, 1e-9)
+            window = max(now - self.window_start, 1e-9)
+            report = {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "uptime_s": round(uptime, 1),
+                **self.counts,
+                "queue_depth": queue_depth,
+                "in_work": in_work,
+                "waiting_for_queue": waiting,
+                "images_per_sec": round(self.counts["done"] / uptime, 3),
+                "images_per_sec_recent": round(self.window_done / window, 3),
+                "mb_per_sec": round(self.bytes_in / uptime / (1024 * 1024), 3),
+                "mb_written": round(self.bytes_out / (1024 * 1024), 3),
+                "latency_ms": self.percentiles(self.latency_ms),
+                "queue_wait_ms": self.percentiles(self.wait_ms),
+                "work_ms": self.percentiles(self.work_ms),
+            }
+            self.window_start = now
+            self.window_done = 0
+        return report
+
+
+def write_json_atomic(path, data):
+    """stats reader never see half written file"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=".part-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+        replace_file(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+# long running batch: edit each new file of in_dir into out_dir
+class HotFolderWatcher:
+    def __init__(
+        self,
+        recipe,
+        in_dir,
+        out_dir,
+        workers=None,
+        queue_size=None,
+        ext=None,
+        stats_path=None,
+        poll=WATCH_POLL,
+        stats_every=WATCH_STATS_EVERY,
+        stable_seconds=WATCH_STABLE_SECONDS,
+        preset=None,
+    ):
+        self.recipe = recipe
+        self.preset = preset
+        self.in_dir = in_dir
+        self.out_dir = out_dir
+        self.ext = ext
+        self.poll_seconds = poll
+        self.stats_every = stats_every
+        self.stats_path = stats_path or os.path.join(out_dir, "watch-stats.json")
+        self.workers = workers or os.cpu_count() or 1
+        # full queue stop the scanner, so file wait on disk and not in memory
+        self.jobs = queue.Queue(maxsize=queue_size or self.workers * 2)
+        self.waiting = deque()  # complete file not yet in queue
+        self.scanner = StableFileScanner(in_dir, stable_seconds=stable_seconds)
+        self.stats = WatchStats()
+        self.in_work = 0
+        self.in_work_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def up_to_date(self, in_path, out_path):
+        """output of restart run is newer than input, no need to do again"""
+        try:
+            return os.path.getmtime(out_path) >= os.path.getmtime(in_path)
+        except OSError:
+            return False
+
+    def worker(self):
+        while True:
+            item = self.jobs.get()
+            if item is None:
+                return
+            in_path, first_seen, queued = item
+            with self.in_work_lock:
+                self.in_work += 1
+            started = time.perf_counter()
+            try:
+                out_path = batch_output_path(
+                    in_path, self.in_dir, self.out_dir, self.ext
+                )
+                size_in, size_out = process_file(
+                    in_path, out_path, self.recipe, self.preset
+                )
+            except Exception as e:
+                self.stats.count("failed")
+                print(f"error: {in_path}: {e}", file=sys.stderr)
+            else:
+                self.stats.finished(first_seen, queued, started, size_in, size_out)
+            finally:
+                with self.in_work_lock:
+                    self.in_work -= 1
+
+    def feed(self):
+        """move complete file into queue until it is full"""
+        while self.waiting:
+            in_path, first_seen = self.waiting[0]
+            try:
+                self.jobs.put_nowait((in_path, first_seen, time.perf_counter()))
+            except queue.Full:
+                return False
+            self.waiting.popleft()
+            self.stats.count("queued")
+        return True
+
+    def scan(self):
+        for in_path, first_seen in self.scanner.poll():
+            out_path = batch_output_path(in_path, self.in_dir, self.out_dir, self.ext)
+            if self.up_to_date(in_path, out_path):
+                self.stats.count("skipped")
+                continue
+            self.waiting.append((in_path, first_seen))
+
+    def idle(self):
+        with self.in_work_lock:
+            busy = self.in_work
+        return not (busy or self.waiting or self.scanner.growing) and self.jobs.empty()
+
+    def write_stats(self):
+        with self.in_work_lock:
+            in_work = self.in_work
+        report = self.stats.snapshot(self.jobs.qsize(), in_work, len(self.waiting))
+        write_json_atomic(self.stats_path, report)
+        return report
+
+    def run(self, exit_idle=None):
+        """poll until stop() or ctrl c, or exit_idle seconds with nothing to do"""
+        self.threads = [
+            threading.Thread(target=self.worker, name=f"watch-{n}", daemon=True)
+            for n in range(self.workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+        next_stats = time.perf_counter() + self.stats_every
+        idle_since = None
+        try:
+            while not self.stop_event.is_set():
+                # backpressure: scanner only look again when queue took all waiting
+                if self.feed():
+                    self.scan()
+                    self.feed()
+                now = time.perf_counter()
+                if now >= next_stats:
+                    self.write_stats()
+                    next_stats = now + self.stats_every
+                if exit_idle is not None:
+                    if not self.idle():
+                        idle_since = None
+                    elif idle_since is None:
+                        idle_since = now
+                    elif now - idle_since >= exit_idle:
+                        break
+                self.stop_event.wait(self.poll_seconds)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for _ in self.threads:
+                self.jobs.put(None)  # worker finish queued file, then stop
+            for thread in self.threads:
+                thread.join()
+        return self.write_stats()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def watch_main(argv):
+    """command line: watch --recipe ops.json in_dir out_dir"""
+    parser = argparse.ArgumentParser(prog="1.py watch")
+    parser.add_argument("--recipe", required=True, help="json list of edit steps")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--queue-size", type=int, default=None, help="complete file waiting at most"
+    )
+    parser.add_argument("--ext", default=None, help="output type, like png")
+    parser.add_argument(
+        "--preset", choices=list(EXPORT_PRESETS), default=None, help="encoder settings"
+    )
+    parser.add_argument("--poll", type=float, default=WATCH_POLL, help="seconds")
+    parser.add_argument(
+        "--stats", default=None, help="stats json path, default out_dir"
+    )
+    parser.add_argument(
+        "--stable-seconds",
+        type=float,
+        default=WATCH_STABLE_SECONDS,
+        help="file unchanged this long is complete",
+    )
+    parser.add_argument("--stats-every", type=float, default=WATCH_STATS_EVERY)
+    parser.add_argument(
+        "--exit-idle",
+        type=float,
+        default=None,
+        help="quit after this many seconds with no work",
+    )
+    parser.add_argument("in_dir")
+    parser.add_argument("out_dir")
+    args = parser.parse_args(argv)
+
+    if os.path.abspath(args.out_dir).startswith(
+        os.path.join(os.path.abspath(args.in_dir), "")
+    ):
+        parser.error("out_dir must not be inside in_dir")
+    try:
+        recipe = load_recipe(args.recipe)
+    except (OSError, ValueError) as e:
+        parser.error(f"cannot use recipe {args.recipe}: {e}")
+    watcher = HotFolderWatcher(
+        recipe,
+        args.in_dir,
+        args.out_dir,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        ext=args.ext,
+        stats_path=args.stats,
+        poll=args.poll,
+        stats_every=args.stats_every,
+        stable_seconds=args.stable_seconds,
+        preset=args.preset,
+    )
+    print(f"watching {args.in_dir}, ctrl c to stop")
+    stats = watcher.run(exit_idle=args.exit_idle)
+    print(
+        f"{stats['done']} done, {stats['skipped']} skipped (already done), "
+        f"{stats['failed']} failed, {stats['images_per_sec']:.2f} images/sec, "
+        f"stats in {watcher.stats_path}"
+    )
+    return 1 if stats["failed"] else 0
+
+
+# size of test image for benchmark, in megapixel
+BENCH_SIZES = (1, 12, 50, 200)
+BENCH_VIEW = (1280, 800)  # canvas size used for preview in benchmark
+BENCH_REGRESSION = 1.10  # p50 slower than this times old run is a regression
+BENCH_FILTERS = {"denoise": 40, "blur": 5, "sharpen": 150, "local_contrast": 50}
+BENCH_NOISE_MS = 1.0  # smaller change than this is timer noise, not regression
+
+
+def synthetic_image(megapixels, seed=0):
+    """3:2 BGR test image, gradient with noise so encoder has real work"""
+    width = int(math.sqrt(megapixels * 1_000_000 * 3 / 2))
+    height = width * 2 // 3
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 32, (height, width, 3), dtype=np.uint8)
+    image += (np.arange(width, dtype=np.uint16) * 200 // width).astype(np.uint8)[
+        None, :, None
+    ]
+    image[..., 1] += (np.arange(height, dtype=np.uint16) * 200 // height).astype(
+        np.uint8
+    )[:, None]
+    return image
+
+
+def peak_rss_mb():
+    """highest memory this process used since start, None when not known"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)  # mac give bytes
+    return peak / 1024  # linux give kilobytes
+
+
+def proc_status_mb(field):
+    """VmRSS or VmHWM of /proc/self/status in MB, None when not linux"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024  # value is in kB
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """start VmHWM again from current rss, False when not linux"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def bench_ops(doc, out_path):
+    """list of (name, setup, run), setup is not timed"""
+    width, height = BENCH_VIEW
+    full = doc.original_image
+    box = (
+        full.shape[1] // 4,
+        full.shape[0] // 4,
+        full.shape[1] * 3 // 4,
+        full.shape[0] * 3 // 4,
+    )
+
+    def edited():
+        doc.set_edit("brightness", 20)
+        doc.set_edit("contrast", 10)
+
+    def undo_ready():
+        if not doc.history.can_undo():
+            doc.add_to_history(full.copy())
+
+    def redo_ready():
+        undo_ready()
+        doc.undo()
+
+    def crop_ready():
+        doc.select_crop(box)
+
+    return [
+        ("open", None, lambda: ImageDocument.open(doc.path).close()),
+        (
+            "resize_50",
+            None,
+            lambda: run_pipeline(full, [{"op": "resize", "value": 50}]),
+        ),
+        ("brightness", None, lambda: brightness_op(full, 20)),
+        ("preview", edited, lambda: doc.preview_job(width, height)()),
+        ("apply_edits", edited, doc.apply_edits),
+        ("apply_crop", crop_ready, doc.apply_crop),
+        ("add_to_history", None, lambda: doc.add_to_history(full.copy())),
+        ("undo", undo_ready, doc.undo),
+        ("redo", redo_ready, doc.redo),
+        ("save", edited, lambda: doc.save(out_path)),
+    ] + [
+        (name, None, functools.partial(FILTER_ENGINE.run, full, name, value))
+        for name, value in BENCH_FILTERS.items()
+    ]
+
+
+def measure(setup, run, repeat):
+    """time run repeat times, then one more run for memory made"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) * 1000)
+
+    # tracemalloc slow down numpy call, so bytes come from separate run
+    if setup is not None:
+        setup()
+    rss_before = proc_status_mb("VmRSS")
+    reset = reset_peak_rss()  # peak rss of this op only, linux only
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    op_peak = proc_status_mb("VmHWM") if reset else None
+
+    percent = np.percentile(times, [50, 90, 99])
+    return {
+        "runs": repeat,
+        "p50_ms": float(percent[0]),
+        "p90_ms": float(percent[1]),
+        "p99_ms": float(percent[2]),
+        "mean_ms": float(np.mean(times)),
+        "bytes_copied": int(peak),
+        # process rss peak while op run, and how much above rss before it
+        "op_peak_rss_mb": op_peak,
+        "op_rss_added_mb": (
+            max(0.0, op_peak - rss_before) if op_peak is not None else None
+        ),
+    }
+
+
+def run_bench(sizes=BENCH_SIZES, repeat=5, ext="jpg", ops=None):
+    """run every op on synthetic image of each size, return report dict"""
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="imgapp-bench-")
+    try:
+        for megapixels in sizes:
+            image = synthetic_image(megapixels)
+            source_path = os.path.join(work_dir, f"source.{ext}")
+            write_image_atomic(source_path, image)
+            doc = ImageDocument(source_path, image)
+            try:
+                out_path = os.path.join(work_dir, f"out.{ext}")
+                for name, setup, run in bench_ops(doc, out_path):
+                    if ops and name not in ops:
+                        continue
+                    stats = measure(setup, run, repeat)
+                    if name in FILTERS:
+                        # same filter as one full frame call, one thread
+                        single = FILTERS[name][0]
+                        value = BENCH_FILTERS[name]
+                        with CV2_THREADS.single():
+                            single = measure(
+                                None, functools.partial(single, image, value), repeat
+                            )
+                        stats["single_p50_ms"] = single["p50_ms"]
+                        stats["speedup"] = single["p50_ms"] / max(stats["p50_ms"], 1e-9)
+                    stats.update(
+                        op=name,
+                        megapixels=megapixels,
+                        width=image.shape[1],
+                        height=image.shape[0],
+                    )
+                    results.append(stats)
+                    print(
+                        f"{megapixels:>4} MP {name:<15} "
+                        f"p50 {stats['p50_ms']:9.1f} ms  "
+                        f"p99 {stats['p99_ms']:9.1f} ms  "
+                        f"copied {stats['bytes_copied'] / (1024 * 1024):8.1f} MB"
+                        + (
+                            f"  speedup {stats['speedup']:.2f}x"
+                            if "speedup" in stats
+                            else ""
+                        )
+                    )
+            finally:
+                doc.close()
+            del image, doc
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "repeat": repeat,
+        "process_peak_rss_mb": peak_rss_mb(),
+        "results": results,
+    }
+
+
+def compare_bench(old, new, threshold=BENCH_REGRESSION):
+    """list of (op, megapixels, old p50, new p50) that got slower"""
+    before = {(r["op"], r["megapixels"]): r for r in old["results"]}
+    slower = []
+    for result in new["results"]:
+        previous = before.get((result["op"], result["megapixels"]))
+        if previous is None:
+            continue
+        after, before_ms = result["p50_ms"], previous["p50_ms"]
+        if after > before_ms * threshold and after - before_ms > BENCH_NOISE_MS:
+            slower.append((result["op"], result["megapixels"], before_ms, after))
+    return slower
+
+
+def bench_main(argv):
+    """command line: bench --sizes 1,12 --out bench.json --compare old.json"""
+    parser = argparse.ArgumentParser(prog="1.py bench")
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in BENCH_SIZES),
+        help="megapixel list, like 1,12,50,200",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--ext", default="jpg", help="file type for open and save")
+    parser.add_argument("--ops", default=None, help="only these op, comma list")
+    parser.add_argument("--out", default="bench.json", help="json report path")
+    parser.add_argument("--compare", default=None, help="old json report")
+    args = parser.parse_args(argv)
+
+    sizes = [
+        float(size) if "." in size else int(size) for size in args.sizes.split(",")
+    ]
+    ops = set(args.ops.split(",")) if args.ops else None
+    report = run_bench(sizes, args.repeat, args.ext, ops)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(
+        f"report written to {args.out}, "
+        f"process peak rss {report['process_peak_rss_mb']} MB"
+    )
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare_bench(json.load(f), report)
+        for op, megapixels, before, after in slower:
+            print(
+                f"regression: {op} at {megapixels} MP {before:.1f} -> {after:.1f} ms",
+                file=sys.stderr,
+            )
+        if slower:
+            return 1
+        print(f"no regression against {args.compare}")
+    return 0
+
+
+def app_main(argv):
+    """command line: 1.py [image] [--startup-timing]"""
+    parser = argparse.ArgumentParser(prog="1.py")
+    parser.add_argument("image", nargs="?", help="open this image at start")
+    parser.add_argument(
+        "--startup-timing",
+        action="store_true",
+        help="print time to first window and first image, then quit",
+    )
+    args = parser.parse_args(argv)
+
     root = tk.Tk()
-    app = ImageProcessingApp(root)
+    startup = StartupTimer() if args.startup_timing else None
+    ImageProcessingApp(root, startup=startup, open_path=args.image)
+    root.after_idle(clean_stale_scratch)  # scratch of crashed run
     root.mainloop()
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(batch_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "watch":
+        sys.exit(watch_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        sys.exit(bench_main(sys.argv[2:]))
+    sys.exit(app_main(sys.argv[1:]))
@@ -1,8 +1,17 @@
-import pygame
+import os
 import sys
 import random
+import time
+from bisect import bisect_left, bisect_right
 from enum import Enum
 
+# Stress mode runs without a window
+if "--stress" in sys.argv:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
 # Initialize pygame
 pygame.init()
 pygame.mixer.init()
@@ -13,6 +22,9 @@ SCREEN_HEIGHT = 700
 FPS = 60
 GRAVITY = 1
 SCROLL_THRESH = 400
+GRID_CELL = 400  # Width of one spatial grid cell in pixels
+HIT_CELL = 64  # Side of one hit test cell in pixels, about one enemy
+FRAME_BUDGET_MS = 1000 / FPS
 
 # Colors
 WHITE = (255, 255, 255)
@@ -62,6 +74,7 @@ class GameObject:
         self.width = width
         self.height = height
         self.vel_y = 0
+        self.alive = True  # False once hit or gone, dropped by compact()
 
     def draw(self, surface, scroll):
         pygame.draw.rect(
@@ -113,8 +126,10 @@ class Player(GameObject):
             self.vel_y = 10
         dy += self.vel_y
 
-        # Check for collision with platforms
-        for platform in platforms:
+        # Check for collision with platforms near the player
+        left = self.rect.left + min(dx, 0)
+        right = self.rect.right + max(dx, 0)
+        for platform in platforms.query(left, right):
             # Check for collision in x direction
             if platform.rect.colliderect(
                 self.rect.x + dx, self.rect.y, self.width, self.height
@@ -158,9 +173,9 @@ class Player(GameObject):
         else:
             self.color = BLUE
 
-        # Check collisions with enemies
+        # Check collisions with nearby enemies
         if self.invincibility <= 0:
-            for enemy in enemies:
+            for enemy in enemies.query(self.rect):
                 if self.rect.colliderect(enemy.rect):
                     self.take_damage(20)
 
@@ -372,6 +387,127 @@ class ScoreBoost(Collectible):
         self.color = YELLOW
 
 
+# Uniform grid over x, each cell lists the platforms that overlap it
+class PlatformGrid:
+    def __init__(self, platforms, cell_size=GRID_CELL):
+        self.cell_size = cell_size
+        self.cells = {}
+        # Position in the level list, so queries keep the original order
+        self.order = {id(platform): i for i, platform in enumerate(platforms)}
+        for platform in platforms:
+            first = platform.rect.left // cell_size
+            last = platform.rect.right // cell_size
+            for cell in range(first, last + 1):
+                self.cells.setdefault(cell, []).append(platform)
+
+    def query(self, left, right):
+        # Platforms that may overlap x from left to right, in level order
+        first = left // self.cell_size
+        last = right // self.cell_size
+        if first == last:
+            return self.cells.get(first, [])
+
+        found = {}
+        for cell in range(first, last + 1):
+            for platform in self.cells.get(cell, []):
+                found[id(platform)] = platform
+        return sorted(found.values(), key=lambda p: self.order[id(p)])
+
+
+# Square cells over the screen, rebuilt each frame from moving entities
+class SpatialHash:
+    def __init__(self, cell_size=HIT_CELL):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.items = []
+
+    def cell_span(self, rect):
+        size = self.cell_size
+        return (
+            range(rect.left // size, (rect.right - 1) // size + 1),
+            range(rect.top // size, (rect.bottom - 1) // size + 1),
+        )
+
+    def rebuild(self, items):
+        cells = self.cells = {}
+        self.items = items
+        for index, item in enumerate(items):
+            columns, rows = self.cell_span(item.rect)
+            for cx in columns:
+                for cy in rows:
+                    cell = cells.get((cx, cy))
+                    if cell is None:
+                        cells[(cx, cy)] = [index]
+                    else:
+                        cell.append(index)
+
+    def query(self, rect):
+        # Live items sharing a cell with rect, in list order, lazily so
+        # a caller that stops at the first hit skips the rest
+        columns, rows = self.cell_span(rect)
+        if len(columns) == 1 and len(rows) == 1:
+            indexes = self.cells.get((columns[0], rows[0]), ())
+        else:
+            found = set()
+            for cx in columns:
+                for cy in rows:
+                    found.update(self.cells.get((cx, cy), ()))
+            indexes = sorted(found)
+        items = self.items
+        for index in indexes:
+            item = items[index]
+            if item.alive:
+                yield item
+
+
+# Remove dead entries in place in one pass, keeping order
+# Returns True if anything was removed
+def compact(items):
+    keep = 0
+    for item in items:
+        if item.alive:
+            items[keep] = item
+            keep += 1
+    removed = keep < len(items)
+    del items[keep:]
+    return removed
+
+
+# Items sorted on an x key for viewport range queries with bisect
+# reach(item) is how far the item's rect can get from its key on either side
+class XIndex:
+    def __init__(self, key, reach):
+        self.key = key
+        self.reach = reach
+        self.source = None
+        self.dirty = True
+        self.keys = []
+        self.order = []  # Position in the source list, in key order
+        self.margin = 0
+
+    def sync(self, items):
+        # Rebuild when given another list or after the list was changed
+        if items is self.source and not self.dirty:
+            return
+        self.order = sorted(range(len(items)), key=lambda i: self.key(items[i]))
+        self.keys = [self.key(items[i]) for i in self.order]
+        self.margin = max((self.reach(item) for item in items), default=0)
+        self.source = items
+        self.dirty = False
+
+    def query(self, left, right):
+        # Items whose rect overlaps x from left to right, in list order
+        start = bisect_left(self.keys, left - self.margin)
+        end = bisect_right(self.keys, right + self.margin)
+        items = self.source
+        visible = []
+        for i in sorted(self.order[start:end]):
+            rect = items[i].rect
+            if rect.right > left and rect.left < right:
+                visible.append(items[i])
+        return visible
+
+
 # Level class
 class Level:
     def __init__(self, level_number):
@@ -380,6 +516,7 @@ class Level:
         self.enemies = []
         self.collectibles = []
         self.boss = None
+        self.platform_grid = None
         self.level_length = 3000 if level_number < 3 else 4000
         self.level_complete = False
         self.victory = False
@@ -414,6 +551,9 @@ class Level:
             width = random.randint(100, 200)
             self.platforms.append(Platform(x, y, width, 20))
 
+        # Index platforms so collision and placement only look nearby
+        self.platform_grid = PlatformGrid(self.platforms)
+
         # Create enemies
         num_enemies = 10 + (self.level_number * 5)
         for _ in range(num_enemies):
@@ -450,7 +590,9 @@ class Level:
         # Find a platform at the given x coordinate
         # Returns the y coordinate of the top of the platform, or None if no platform found
         possible_platforms = [
-            p for p in self.platforms if p.rect.left <= x <= p.rect.right
+            p
+            for p in self.platform_grid.query(x, x)
+            if p.rect.left <= x <= p.rect.right
         ]
         if possible_platforms:
             # Return the highest platform (lowest y value)
@@ -469,6 +611,16 @@ class Game:
         self.projectiles = []
         self.enemy_projectiles = []
         self.score = 0
+        self.enemy_hash = SpatialHash()
+
+        # Sorted on x so draw only visits what is on screen
+        self.platform_view = XIndex(lambda p: p.rect.left, lambda p: p.width)
+        self.collectible_view = XIndex(lambda c: c.rect.left, lambda c: c.width)
+        # Enemies only move within their patrol around start_x
+        self.enemy_view = XIndex(
+            lambda e: e.start_x,
+            lambda e: e.patrol_distance + e.speed + e.width,
+        )
 
     def start_game(self):
         self.level_number = 1
@@ -524,34 +676,39 @@ class Game:
 
     def update(self):
         if self.state == GameState.PLAYING:
+            # Enemies stay still until their update, so hash them once
+            self.enemy_hash.rebuild(self.level.enemies)
+
             # Update player
             collected = self.player.update(
-                self.level.platforms, self.level.enemies, self.level.collectibles
+                self.level.platform_grid, self.enemy_hash, self.level.collectibles
             )
 
             # Remove collected items
             for item in collected:
-                self.level.collectibles.remove(item)
+                item.alive = False
                 if isinstance(item, ScoreBoost):
                     self.score += item.amount
+            if collected:
+                compact(self.level.collectibles)
+                self.collectible_view.dirty = True
 
             # Camera follow
             if self.player.rect.right - self.scroll_x > SCROLL_THRESH:
                 self.scroll_x = self.player.rect.right - SCROLL_THRESH
 
             # Update projectiles
-            projectiles_to_remove = []
             for projectile in self.projectiles:
                 if projectile.update(self.scroll_x):
-                    projectiles_to_remove.append(projectile)
+                    projectile.alive = False
                 else:
-                    # Check projectile collision with enemies
-                    for enemy in self.level.enemies:
+                    # Check projectile collision with nearby enemies
+                    for enemy in self.enemy_hash.query(projectile.rect):
                         if projectile.rect.colliderect(enemy.rect):
                             enemy.take_damage(projectile.damage)
-                            projectiles_to_remove.append(projectile)
+                            projectile.alive = False
                             if enemy.is_dead():
-                                self.level.enemies.remove(enemy)
+                                enemy.alive = False
                                 self.score += 50
                             break
 
@@ -560,7 +717,7 @@ class Game:
                         self.level.boss.rect
                     ):
                         self.level.boss.take_damage(projectile.damage)
-                        projectiles_to_remove.append(projectile)
+                        projectile.alive = False
                         if self.level.boss.is_dead():
                             self.level.boss = None
                             self.score += 500
@@ -568,19 +725,15 @@ class Game:
                                 self.level.victory = True
 
             # Remove projectiles
-            for projectile in projectiles_to_remove:
-                if projectile in self.projectiles:
-                    self.projectiles.remove(projectile)
+            compact(self.projectiles)
 
-            # Update enemies
-            enemies_to_remove = []
+            # Update enemies, dead ones are skipped and removed
             for enemy in self.level.enemies:
-                if enemy.update(self.scroll_x):
-                    enemies_to_remove.append(enemy)
+                if enemy.alive and enemy.update(self.scroll_x):
+                    enemy.alive = False
 
-            for enemy in enemies_to_remove:
-                if enemy in self.level.enemies:
-                    self.level.enemies.remove(enemy)
+            if compact(self.level.enemies):
+                self.enemy_view.dirty = True
 
             # Update boss
             if self.level.boss:
@@ -595,17 +748,14 @@ class Game:
                         self.enemy_projectiles.append(new_projectile)
 
             # Update enemy projectiles
-            enemy_projectiles_to_remove = []
             for projectile in self.enemy_projectiles:
                 if projectile.update(self.scroll_x):
-                    enemy_projectiles_to_remove.append(projectile)
+                    projectile.alive = False
                 elif projectile.rect.colliderect(self.player.rect):
                     self.player.take_damage(projectile.damage)
-                    enemy_projectiles_to_remove.append(projectile)
+                    projectile.alive = False
 
-            for projectile in enemy_projectiles_to_remove:
-                if projectile in self.enemy_projectiles:
-                    self.enemy_projectiles.remove(projectile)
+            compact(self.enemy_projectiles)
 
             # Check for level completion
             if self.player.rect.x > self.level.level_length - 200 or self.level.victory:
@@ -631,16 +781,23 @@ class Game:
             )
 
         elif self.state == GameState.PLAYING or self.state == GameState.LEVEL_COMPLETE:
+            # Only what overlaps the screen is drawn
+            view_left = self.scroll_x
+            view_right = self.scroll_x + SCREEN_WIDTH
+            self.platform_view.sync(self.level.platforms)
+            self.collectible_view.sync(self.level.collectibles)
+            self.enemy_view.sync(self.level.enemies)
+
             # Draw platforms
-            for platform in self.level.platforms:
+            for platform in self.platform_view.query(view_left, view_right):
                 platform.draw(screen, self.scroll_x)
 
             # Draw collectibles
-            for collectible in self.level.collectibles:
+            for collectible in self.collectible_view.query(view_left, view_right):
                 collectible.draw(screen, self.scroll_x)
 
             # Draw enemies
-            for enemy in self.level.enemies:
+            for enemy in self.enemy_view.query(view_left, view_right):
                 enemy.draw(screen, self.scroll_x)
 
             # Draw boss
@@ -710,6 +867,99 @@ class Game:
         pygame.display.flip()
 
 
+# Bullet heavy scene timed without a window, returns 1 if update is over budget
+def stress(
+    frames=300,
+    projectile_count=2000,
+    enemy_count=1000,
+    level_length=100000,
+    warmup=30,
+    runs=3,
+):
+    random.seed(0)
+    game = Game()
+    game.start_game()
+    game.player.lives = frames  # Keep playing whatever gets hit
+    level = game.level
+
+    # Long level, so drawing has to skip what is off screen
+    for x in range(level.level_length, level_length, 500):
+        level.platforms.append(Platform(x, SCREEN_HEIGHT - 50, 400, 50))
+        level.collectibles.append(ScoreBoost(x + 200, SCREEN_HEIGHT - 200))
+    level.level_length = level_length
+    level.platform_grid = PlatformGrid(level.platforms)
+
+    def spawn_enemy():
+        x = random.randint(0, SCREEN_WIDTH - 50)
+        enemy = Enemy(x, random.randint(0, SCREEN_HEIGHT - 100), patrol_distance=0)
+        enemy.speed = 0  # Stays on screen so the count holds
+        enemy.health = enemy.max_health = 10**9
+        return enemy
+
+    def spawn_projectile():
+        direction = random.choice((1, -1))
+        x = random.randint(0, SCREEN_WIDTH - 10)
+        return Projectile(x, random.randint(0, SCREEN_HEIGHT - 100), direction)
+
+    level.enemies = [spawn_enemy() for _ in range(enemy_count)]
+    # Warm-up frames fill caches and the spatial hash, they are not timed
+    runs_p95 = {"update": [], "draw": [], "frame": []}
+    timed = 0
+    for run in range(-1, runs):
+        times = {"update": [], "draw": [], "frame": []}
+        for _ in range(warmup if run < 0 else frames):
+            # Top up what left the screen or hit something last frame
+            while len(game.projectiles) < projectile_count:
+                game.projectiles.append(spawn_projectile())
+            if len(level.enemies) < enemy_count:
+                game.enemy_view.dirty = True
+            while len(level.enemies) < enemy_count:
+                level.enemies.append(spawn_enemy())
+
+            start = time.perf_counter()
+            game.update()
+            middle = time.perf_counter()
+            game.draw()
+            end = time.perf_counter()
+            times["update"].append((middle - start) * 1000)
+            times["draw"].append((end - middle) * 1000)
+            times["frame"].append((end - start) * 1000)
+            if game.state != GameState.PLAYING:
+                break
+        if run < 0 or not times["frame"]:
+            continue
+        timed += len(times["frame"])
+        for name, values in times.items():
+            values.sort()
+            runs_p95[name].append(values[int(len(values) * 0.95)])
+        if game.state != GameState.PLAYING:
+            break
+
+    print(
+        f"{projectile_count} projectiles, {enemy_count} enemies, "
+        f"{len(level.platforms)} platforms, {warmup} warm-up frames, "
+        f"{timed} timed frames in {len(runs_p95['frame'])} runs"
+    )
+    if not runs_p95["frame"]:
+        print("game ended during warm-up")
+        return 1
+    p95s = {}
+    for name, values in runs_p95.items():
+        # Median over runs, so one slow run (a GC pass, a busy CI box) does
+        # not decide the result
+        values.sort()
+        p95s[name] = values[len(values) // 2]
+        runs_text = ", ".join(f"{value:.2f}" for value in values)
+        print(f"{name}: p95 median {p95s[name]:.2f} ms (runs {runs_text})")
+    # The budget covers the whole frame, update and draw together
+    within = p95s["frame"] <= FRAME_BUDGET_MS
+    print(
+        f"frame {'within' if within else 'over'} "
+        f"{FRAME_BUDGET_MS:.1f} ms frame budget"
+    )
+    return 0 if within else 1
+
+
 # Main function
 def main():
     # Create game instance
@@ -735,4 +985,6 @@ def main():
 
 
 if __name__ == "__main__":
+    if "--stress" in sys.argv:
+        sys.exit(stress())
     main()
@@ -0,0 +1,10 @@
+import importlib.util
+import os
+import sys
+
+# 1.py is not a valid module name, so load it from its path as imgapp
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location("imgapp", os.path.join(ROOT, "1.py"))
+imgapp = importlib.util.module_from_spec(spec)
+sys.modules["imgapp"] = imgapp
+spec.loader.exec_module(imgapp)
@@ -0,0 +1,106 @@
+import os
+
+import imgapp
+import numpy as np
+import pytest
+
+
+def image(value, shape=(300, 400, 3)):
+    """image that differ per step and per tile, so mixed tiles show up"""
+    rows = np.arange(shape[0], dtype=np.uint16)[:, None, None]
+    return ((rows + value * 7) % 256).astype(np.uint8) * np.ones(shape, np.uint8)
+
+
+@pytest.fixture
+def history():
+    # small tiles and no ram, so every step but the current one is spilled
+    history = imgapp.TileHistory(tile_size=64, ram_limit=0)
+    yield history
+    history.close()
+
+
+def test_undo_redo_across_crop_size_and_spill(history):
+    steps = [image(0), image(1), image(2)[50:250, 100:300], image(3, (200, 200, 3))]
+    history.reset(steps[0], [])
+    for number, step in enumerate(steps[1:], 1):
+        history.push(step.copy(), [{"op": "brightness", "value": number}])
+    assert history.scratch_dir is not None
+    assert os.listdir(history.scratch_dir) != ["owner.pid"]
+
+    for step in reversed(steps[:-1]):
+        assert history.undo()
+        assert np.array_equal(history.current(), step)
+    assert not history.undo()
+    for step in steps[1:]:
+        assert history.redo()
+        assert np.array_equal(history.current(), step)
+    assert not history.redo()
+    assert history.meta() == [{"op": "brightness", "value": 3}]
+
+
+def test_push_after_undo_drops_redo(history):
+    history.reset(image(0), [])
+    history.push(image(1), None)
+    history.push(image(2), None)
+    history.undo()
+    history.push(image(5), None)
+    assert not history.can_redo()
+    assert len(history) == 3
+    assert np.array_equal(history.current(), image(5))
+
+
+def test_snapshot_survives_undo_in_place():
+    history = imgapp.TileHistory(tile_size=64, ram_limit=None)
+    try:
+        history.reset(image(0), [])
+        history.push(image(1), None)
+        history.push(image(2), None)
+        history.undo()  # frame is now owned, later undo write in it
+        snapshot = history.snapshot()
+        history.undo()
+        history.redo()
+        history.redo()
+        assert np.array_equal(snapshot(), image(1))
+        assert np.array_equal(history.current(), image(2))
+    finally:
+        history.close()
+
+
+def test_close_removes_scratch(history):
+    history.reset(image(0), [])
+    history.push(image(1), None)
+    folder = history.scratch_dir
+    assert folder in imgapp.SCRATCH_DIRS
+    history.close()
+    assert not os.path.exists(folder)
+    assert folder not in imgapp.SCRATCH_DIRS
+
+
+def test_scanner_waits_for_stable_size(tmp_path):
+    scanner = imgapp.StableFileScanner(str(tmp_path), stable_seconds=1.0)
+    path = str(tmp_path / "a.png")
+    with open(path, "wb") as f:
+        f.write(b"x" * 10)
+    assert scanner.poll(now=0.0) == []
+
+    with open(path, "ab") as f:
+        f.write(b"x" * 10)  # still being written
+    assert scanner.poll(now=0.5) == []
+    assert scanner.poll(now=1.0) == []  # same size, but not quiet long enough
+    assert scanner.poll(now=1.6) == [(path, 0.0)]
+    assert scanner.poll(now=5.0) == []  # given once
+
+    with open(path, "ab") as f:
+        f.write(b"x")  # changed after taken, given again once stable
+    os.utime(path, ns=(10**9, 10**9))
+    assert scanner.poll(now=6.0) == []
+    assert scanner.poll(now=7.5) == [(path, 6.0)]
+
+
+def test_scanner_skips_hidden_and_empty(tmp_path):
+    scanner = imgapp.StableFileScanner(str(tmp_path), stable_seconds=0.0)
+    (tmp_path / ".part-1.png").write_bytes(b"x")
+    (tmp_path / "empty.png").write_bytes(b"")
+    (tmp_path / "notes.txt").write_bytes(b"x")
+    for now in range(3):
+        assert scanner.poll(now=float(now)) == []
@@ -0,0 +1,78 @@
+import os
+
+import imgapp
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+
+
+def history_pixels(doc):
+    """copy of every step from first to last, doc end at last step"""
+    while doc.undo():
+        pass
+    steps = [doc.history.current().copy()]
+    while doc.redo():
+        steps.append(doc.history.current().copy())
+    return steps
+
+
+@pytest.fixture
+def edited_doc(tmp_path):
+    """document with a brightness step, a crop step and a pending edit"""
+    source = str(tmp_path / "source.png")
+    image = np.random.default_rng(0).integers(0, 256, (300, 400, 3), np.uint8)
+    cv2.imwrite(source, image)
+    doc = imgapp.ImageDocument.open(source)
+    doc.set_edit("brightness", 30)
+    doc.apply_edits()
+    doc.select_crop((20, 10, 320, 210))
+    doc.apply_crop()
+    doc.set_edit("contrast", 20)
+    yield doc
+    doc.close()
+
+
+def test_reopen_keeps_every_history_step(edited_doc, tmp_path):
+    path = str(tmp_path / "edit.imgsession")
+    imgapp.save_session(edited_doc, path)
+    expected = history_pixels(edited_doc)
+
+    doc = imgapp.load_session(path)
+    try:
+        assert doc.edits == {"contrast": 20}
+        assert doc.recipe() == edited_doc.recipe()
+        assert np.array_equal(doc.history.current(), expected[-1])
+        assert len(expected) == 3
+        for got, want in zip(history_pixels(doc), expected):
+            assert np.array_equal(got, want)
+    finally:
+        doc.close()
+
+
+def test_reopened_session_saves_current_pixels(edited_doc, tmp_path):
+    path = str(tmp_path / "edit.imgsession")
+    imgapp.save_session(edited_doc, path)
+    expected = edited_doc.history.current().copy()
+
+    doc = imgapp.load_session(path)
+    try:
+        # slider moved and back, nothing pending, save writes current step
+        doc.set_edit("contrast", imgapp.SLIDER_NEUTRAL["contrast"])
+        doc.set_edit("brightness", 40)
+        doc.history.current()
+        doc.set_edit("brightness", imgapp.SLIDER_NEUTRAL["brightness"])
+        out = str(tmp_path / "out.png")
+        doc.save(out)
+        assert np.array_equal(cv2.imread(out), expected)
+    finally:
+        doc.close()
+
+
+def test_incomplete_session_is_refused(edited_doc, tmp_path):
+    path = str(tmp_path / "edit.imgsession")
+    imgapp.save_session(edited_doc, path)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 4)
+    with pytest.raises(ValueError):
+        imgapp.load_session(path)